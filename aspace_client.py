@@ -0,0 +1,65 @@
+import threading
+from requests.adapters import HTTPAdapter
+from config import Config
+import instrumentation
+
+_client = None
+_pool_size = 0
+_lock = threading.Lock()
+
+
+def get_client():
+    """
+    The shared ArchivesSpace client, created and logged in on first use.
+
+    Importing modules that talk to ArchivesSpace costs no requests, so
+    `--help` and argument errors work without a live server, and a run logs
+    in exactly once however many modules use the client.
+    """
+    global _client, _pool_size
+    with _lock:
+        if _client is None:
+            # ASnake is imported here, not at module level, to keep startup short
+            from asnake.client import ASnakeClient
+            client = ASnakeClient(
+                baseurl=Config.aspace_host,
+                username=Config.aspace_user,
+                password=Config.aspace_pass
+            )
+            # Enough pooled connections for every worker thread to keep one
+            # open; size_pool() grows it if a run uses more workers
+            _pool_size = max(10, _pool_size, getattr(Config, 'workers', 1))
+            _mount_pool(client.session, _pool_size)
+            instrumentation.install(client.session)
+            client.authorize()
+            _client = client
+        return _client
+
+
+def _mount_pool(session, size):
+    adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+
+def size_pool(workers):
+    """
+    Give the shared client enough pooled connections for workers threads to
+    keep one open each. Call with the run's effective worker count (e.g. from
+    --workers) before starting them; the pool only ever grows.
+    """
+    global _pool_size
+    with _lock:
+        if workers <= max(10, _pool_size):
+            return
+        _pool_size = workers
+        if _client is not None:
+            _mount_pool(_client.session, workers)
+
+
+def reset():
+    """Forget the shared client, e.g. after pointing Config at another server."""
+    global _client, _pool_size
+    with _lock:
+        _client = None
+        _pool_size = 0
@@ -1,36 +1,147 @@
-from asnake.aspace import ASpace
 from config import Config
+import aspace_client
+import instrumentation
+import copy
+import json
 import re
+import threading
+import uuid
+from collections import OrderedDict
 
-# Initialize aspace client once
-aspace = ASpace(
-    baseurl=Config.aspace_host,
-    username=Config.aspace_user,
-    password=Config.aspace_pass
-)
+def subject_query(subject_term):
+    """Solr query for archival objects with the given subject term."""
+    # Ensure multiword phrases are quoted for exact matching
+    if ' ' in subject_term and not (subject_term.startswith('"') and subject_term.endswith('"')):
+        subject_term = f'"{subject_term}"'
+
+    return f"primary_type:archival_object AND subjects:{subject_term}"
 
-def search_ao_by_subject(repo_id: int, subject_term: str):
+# Search index fields needed to decide whether a hit is worth fetching in full.
+# The notes are only in `json`, which is most of each result, so this saves
+# little transfer; it skips the other indexed fields and the jsonmodel objects
+SEARCH_FIELDS = ['uri', 'json']
+
+class SearchHit:
     """
-    Search archival objects in the given repository by subject term.
-    
+    Lightweight archival object search result holding only what the sync
+    needs before deciding to fetch the full record with json().
+    """
+
+    __slots__ = ('uri', 'ref_id', 'lock_version', 'system_mtime', 'resource_ref', 'note_urls', 'record')
+
+    def __init__(self, uri, ref_id=None, lock_version=None, system_mtime=None, resource_ref=None, note_urls=(), record=None):
+        self.uri = uri
+        self.ref_id = ref_id
+        self.lock_version = lock_version
+        self.system_mtime = system_mtime
+        self.resource_ref = resource_ref
+        self.note_urls = list(note_urls)
+        self.record = record
+
+    @classmethod
+    def from_doc(cls, doc, note_label=None):
+        """
+        A hit from a search result. The indexed copy of the record is only
+        read for its note URLs and sync state, then dropped: it can lag the
+        database, and keeping it for every hit would grow memory with the
+        repository, so json() fetches the current record (and lock_version).
+        """
+        record = json.loads(doc.get('json') or '{}')
+        hit = cls.from_record(record, note_label)
+        hit.uri = doc.get('uri') or hit.uri
+        hit.record = None
+        return hit
+
+    @classmethod
+    def from_record(cls, record, note_label=None):
+        """A hit that keeps an already fetched full record, so json() costs no request."""
+        note_urls = extract_notes_by_label_or_type(record, label=note_label, note_type="phystech") if note_label else []
+        return cls(
+            record.get('uri'),
+            ref_id=record.get('ref_id'),
+            lock_version=record.get('lock_version'),
+            system_mtime=record.get('system_mtime'),
+            resource_ref=record.get('resource', {}).get('ref'),
+            note_urls=note_urls,
+            record=record,
+        )
+
+    def json(self):
+        """The full archival object record, fetched unless the hit already holds it."""
+        if self.record is not None:
+            record, self.record = self.record, None
+            return record
+        return aspace_client.get_client().get(self.uri).json()
+
+def iter_ao_by_subject(repo_id, subject_term, note_label=None, page_size=None):
+    """
+    Page through archival objects with the given subject, yielding SearchHits.
+
+    Only SEARCH_FIELDS are requested and each page is discarded once its hits
+    are yielded, so memory does not grow with the size of the repository.
+    Each hit that gets processed costs one GET for its current record.
+
     Args:
         repo_id: The repository ID in ArchivesSpace.
         subject_term: The subject term or phrase to search for.
-                      If multiword, no need to add quotes — function adds them.
-    
-    Returns:
-        list: List of archival object results (asnake jsonmodelobjects).
+        note_label: Label of the phystech notes holding web archive URLs;
+                    matching note contents are kept on each hit as note_urls.
+        page_size: Results per search request. Defaults to Config.search_page_size.
+
+    Yields:
+        SearchHit: One per matching archival object.
     """
-    repo = aspace.repositories(repo_id)
+    page_size = page_size or Config.search_page_size
+    query = subject_query(subject_term)
+
+    page = 1
+    while True:
+        response = aspace_client.get_client().get(
+            f"/repositories/{repo_id}/search",
+            params={'q': query, 'page': page, 'page_size': page_size, 'fields': SEARCH_FIELDS}
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        for doc in data.get('results', []):
+            yield SearchHit.from_doc(doc, note_label)
+
+        if page >= data.get('last_page', page):
+            break
+        page += 1
 
-    # Ensure multiword phrases are quoted for exact matching
-    if ' ' in subject_term and not (subject_term.startswith('"') and subject_term.endswith('"')):
-        subject_term = f'"{subject_term}"'
+def iter_ao_by_ref_ids(repo_id, ref_ids, note_label=None, chunk_size=None):
+    """
+    Resolve archival objects by ref_id, yielding SearchHits that hold the
+    full records.
 
-    query = f"primary_type:archival_object AND subjects:{subject_term}"
-    search_results = repo.search.with_params(q=query)
-    
-    return list(search_results)
+    Ids are sent chunk_size at a time as a multi-valued ref_id[] find_by_id
+    request with resolve[]=archival_objects, so each chunk costs one request
+    no matter how many records it returns. Ids that match nothing are left
+    out; compare hit.ref_id against the input to report them.
+
+    Args:
+        repo_id: The repository ID in ArchivesSpace.
+        ref_ids: Archival object ref_ids.
+        note_label: Label of the phystech notes holding web archive URLs.
+        chunk_size: Ids per request. Defaults to Config.refid_chunk_size.
+
+    Yields:
+        SearchHit: One per archival object found.
+    """
+    chunk_size = chunk_size or Config.refid_chunk_size
+    ref_ids = list(ref_ids)
+    for start in range(0, len(ref_ids), chunk_size):
+        response = aspace_client.get_client().get(
+            f"/repositories/{repo_id}/find_by_id/archival_objects",
+            params={'ref_id': ref_ids[start:start + chunk_size], 'resolve': ['archival_objects']}
+        )
+        response.raise_for_status()
+        for found in response.json().get('archival_objects', []):
+            record = found.get('_resolved')
+            if record is None:
+                record = aspace_client.get_client().get(found['ref']).json()
+            yield SearchHit.from_record(record, note_label)
 
 def extract_notes_by_label_or_type(archival_object, label=None, note_type=None, label_regex=False):
     """
@@ -76,13 +187,102 @@ def get_digital_object_instance(ao_json):
     return None
 
 def fetch_digital_object(digital_object_ref):
-    return aspace.client.get(digital_object_ref).json()
+    return aspace_client.get_client().get(digital_object_ref).json()
 
-def create_new_dao(file_uri, digital_object_id, title, repo_id, ao_json, uri):
+class DigitalObjectIndex:
     """
-    Creates a digital object record and links it to an archival object.
+    Existing digital objects in a repository, by digital_object_id and by
+    file_uri, so DAO creation can reuse a record instead of POSTing a duplicate.
+    """
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_file_uri = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def add(self, dao_uri, digital_object_id=None, file_uris=()):
+        with self.lock:
+            if digital_object_id:
+                self.by_id.setdefault(digital_object_id, dao_uri)
+            for file_uri in file_uris:
+                if file_uri:
+                    self.by_file_uri.setdefault(file_uri, dao_uri)
+
+    def add_record(self, dao_json):
+        self.add(
+            dao_json.get('uri'),
+            dao_json.get('digital_object_id'),
+            [fv.get('file_uri') for fv in dao_json.get('file_versions', [])]
+        )
+
+    def find(self, digital_object_id=None, file_uri=None):
+        with self.lock:
+            return self.by_id.get(digital_object_id) or self.by_file_uri.get(file_uri)
+
+def build_dao_index(repo_id, page_size=None, max_pages=None):
     """
-    dao_json = {
+    Page through every digital object in the repository once and index it.
+
+    Args:
+        repo_id: The repository ID in ArchivesSpace.
+        page_size: Records per request. Defaults to Config.dao_index_page_size.
+        max_pages: Give up after the first page if indexing would take more
+                   requests than this, e.g. more than looking up each DAO.
+
+    Returns:
+        DigitalObjectIndex, or None if it would exceed max_pages.
+    """
+    page_size = page_size or Config.dao_index_page_size
+    index = DigitalObjectIndex()
+    page = 1
+    while True:
+        response = aspace_client.get_client().get(
+            f"/repositories/{repo_id}/digital_objects",
+            params={'page': page, 'page_size': page_size}
+        )
+        response.raise_for_status()
+        data = response.json()
+        if max_pages is not None and data.get('last_page', 1) > max_pages:
+            return None
+        for dao_json in data.get('results', []):
+            index.add_record(dao_json)
+        if page >= data.get('last_page', page):
+            break
+        page += 1
+    print(f"Indexed {len(index)} existing digital objects.")
+    return index
+
+def find_dao_by_digital_object_id(repo_id, digital_object_id):
+    """Look up a single digital object URI by its identifier, without an index."""
+    response = aspace_client.get_client().get(
+        f"/repositories/{repo_id}/find_by_id/digital_objects",
+        params={'digital_object_id[]': digital_object_id}
+    )
+    response.raise_for_status()
+    found = response.json().get('digital_objects', [])
+    return found[0]['ref'] if found else None
+
+def find_daos_by_digital_object_ids(repo_id, digital_object_ids):
+    """Existing digital object URIs by identifier, looked up in one find_by_id request."""
+    if not digital_object_ids:
+        return {}
+    response = aspace_client.get_client().get(
+        f"/repositories/{repo_id}/find_by_id/digital_objects",
+        params={'digital_object_id': list(digital_object_ids), 'resolve': ['digital_objects']}
+    )
+    response.raise_for_status()
+    found = {}
+    for result in response.json().get('digital_objects', []):
+        digital_object_id = result.get('_resolved', {}).get('digital_object_id')
+        if digital_object_id:
+            found.setdefault(digital_object_id, result['ref'])
+    return found
+
+def build_dao_json(file_uri, digital_object_id, title):
+    return {
         "jsonmodel_type": "digital_object",
         "title": title,
         "digital_object_id": digital_object_id,
@@ -100,7 +300,12 @@ def create_new_dao(file_uri, digital_object_id, title, repo_id, ao_json, uri):
         "publish": True
     }
 
-    response = aspace.client.post(f"/repositories/{repo_id}/digital_objects", json=dao_json)
+def create_new_dao(file_uri, digital_object_id, title, repo_id, ao_json, uri):
+    """
+    Creates a digital object record and links it to an archival object.
+    """
+    dao_json = build_dao_json(file_uri, digital_object_id, title)
+    response = aspace_client.get_client().post(f"/repositories/{repo_id}/digital_objects", json=dao_json)
 
     if response.status_code == 200:
         dao_ref = response.json().get("uri")
@@ -111,22 +316,22 @@ def create_new_dao(file_uri, digital_object_id, title, repo_id, ao_json, uri):
         print(f"Response text: {response.text}")
         return None
     
-def link_dao_to_ao(dao_ref, ao_json, uri):
+def add_dao_instance(ao_json, dao_ref):
+    """
+    Add a digital object instance for dao_ref to the archival object JSON.
+    Returns False if the record already links to it.
+    """
     instances = ao_json.get("instances", [])
+    for inst in instances:
+        if inst.get("digital_object", {}).get("ref") == dao_ref:
+            return False
     instances.append({
         "instance_type": "digital_object",
         "digital_object": {"ref": dao_ref}
     })
     ao_json["instances"] = instances
+    return True
 
-    response = aspace.client.post(uri, json=ao_json)
-    if response.status_code == 200: 
-        return response.json()
-    else:
-        print(f"Failed to link DAO to AO. Status: {response.status_code}")
-        print(f"Response text: {response.text}")
-        return None
-    
 def update_dates(ao_json, begin_date, end_date, date_expression, crawl_date_label):
     """
     Update or create a "captured" date subcrecord on the archival object JSON. 
@@ -205,26 +410,73 @@ def update_extent(ao_json, new_extent_number, config):
         ao_json['extents'] = extents
         return True
     
-def get_parent_json(child_json):
-    '''Takes a child JSON, finds the parent ref, and retrieves the parent JSON'''
-    parent_ref = child_json.get('parent', {}).get('ref')
-    if not parent_ref:
-        return False  # No parent to update
-
-    parent_json = aspace.client.get(parent_ref).json()
-    return parent_json
+class RecordCache:
+    """
+    Size-bounded LRU cache of record JSON (including its lock_version) by URI.
+    Callers get copies, so editing a returned record never touches the cache;
+    successful writes put the saved version back with put().
 
-def get_resource_json(child_json):  
-    resource_ref = child_json.get('resource', {}).get('ref')
-    if not resource_ref:
-        return False
-    resource_json = aspace.client.get(resource_ref).json()
-    return resource_json
+    Args:
+        max_size: Maximum number of records kept.
+    """
 
-def update_ancestor_dates_if_needed(ancestor_json, begin_date, end_date):
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.records = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, uri):
+        with self.lock:
+            record = self.records.get(uri)
+            if record is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.records.move_to_end(uri)
+            return copy.deepcopy(record)
+
+    def put(self, uri, record):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.records[uri] = copy.deepcopy(record)
+            self.records.move_to_end(uri)
+            while len(self.records) > self.max_size:
+                self.records.popitem(last=False)
+
+    def invalidate(self, uri):
+        with self.lock:
+            self.records.pop(uri, None)
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.records), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+record_cache = RecordCache(Config.record_cache_size)
+
+def get_record(uri):
+    """Record JSON by URI, served from record_cache when possible."""
+    record = record_cache.get(uri)
+    if record is None:
+        record = aspace_client.get_client().get(uri).json()
+        record_cache.put(uri, record)
+    return record
+
+def expand_ancestor_dates(ancestor_json, begin_date, end_date):
     """
-    Ensure the ancestor (another AO or resource record) range includes the child's date range.
-    If the parent date is missing or narrower, update it and return True.
+    Widen the ancestor (another AO or resource record) date range in place so it
+    includes the child's date range. Returns True if the JSON was changed.
     """
     parent_dates = ancestor_json.get('dates', [])
     needs_update = False
@@ -268,15 +520,425 @@ def update_ancestor_dates_if_needed(ancestor_json, begin_date, end_date):
                 expression += f" - {date_obj['end']}"
             date_obj['expression'] = expression
 
-    if needs_update:
-        response = aspace.client.post(ancestor_json['uri'], json=ancestor_json)
+    return needs_update
+
+def save_ancestor(ancestor_json):
+    response = aspace_client.get_client().post(ancestor_json['uri'], json=ancestor_json)
+    if response.status_code == 200:
+        print(f"Updated parent AO {ancestor_json['uri']} with expanded date range.")
+        # Keep the cache current so later lookups see the widened dates
+        ancestor_json['lock_version'] = response.json().get('lock_version', ancestor_json.get('lock_version'))
+        record_cache.put(ancestor_json['uri'], ancestor_json)
+    else:
+        record_cache.invalidate(ancestor_json['uri'])
+        print(f"Failed to update parent AO {ancestor_json['uri']}. Status: {response.status_code}")
+        print(response.text)
+    return response
+
+class ChangeSet:
+    """
+    The updates computed for one archival object, kept apart from the record
+    itself so they can be applied in a single write (and re-applied to a
+    freshly loaded copy of the record if needed).
+
+    Args:
+        uri: The archival object URI.
+    """
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.dates = None
+        self.extent = None
+        self.notes = []
+        self.dao = None
+        self.dao_ref = None
+        self.cdx_summaries = {}
+        self.collections = {}
+        self.changed = []
+
+    def __bool__(self):
+        return bool(self.dates or self.extent is not None or self.notes or self.dao or self.dao_ref)
+
+    def set_capture_dates(self, begin_date, end_date, date_expression):
+        self.dates = (begin_date, end_date, date_expression)
+
+    def set_extent(self, extent_number):
+        self.extent = extent_number
+
+    def add_note(self, note_type, text, label=None):
+        if (note_type, text, label) not in self.notes:
+            self.notes.append((note_type, text, label))
+
+    def set_dao(self, file_uri, digital_object_id, title):
+        """Request a new digital object, created at commit time if the record still has none."""
+        self.dao = {'file_uri': file_uri, 'digital_object_id': digital_object_id, 'title': title}
+
+    def as_dict(self):
+        return {
+            'uri': self.uri,
+            'dates': list(self.dates) if self.dates else None,
+            'extent': self.extent,
+            'notes': [list(note) for note in self.notes],
+            'dao': self.dao,
+            'dao_ref': self.dao_ref,
+            'cdx_summaries': self.cdx_summaries,
+            'collections': self.collections,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a change set saved with as_dict(), e.g. from a --plan file."""
+        change_set = cls(data['uri'])
+        change_set.dates = tuple(data['dates']) if data.get('dates') else None
+        change_set.extent = data.get('extent')
+        change_set.notes = [tuple(note) for note in data.get('notes', [])]
+        change_set.dao = data.get('dao')
+        change_set.dao_ref = data.get('dao_ref')
+        change_set.cdx_summaries = data.get('cdx_summaries') or {}
+        change_set.collections = data.get('collections') or {}
+        return change_set
+
+    def apply(self, ao_json, config=Config):
+        """
+        Apply the change set to an archival object JSON in place.
+
+        Returns:
+            list: Names of the parts of the record that changed.
+        """
+        changed = []
+        if self.dates and update_dates(ao_json, *self.dates, config.crawl_date_label):
+            changed.append("Dates")
+        if self.extent is not None and update_extent(ao_json, self.extent, config):
+            changed.append("Extent")
+        for note_type, text, label in self.notes:
+            if update_or_create_note(ao_json, note_type, text, label):
+                changed.append(f"Note ({note_type})")
+        if self.dao_ref and add_dao_instance(ao_json, self.dao_ref):
+            changed.append("DAO link")
+        return changed
+
+def diff_fields(before, after):
+    """field -> {'before': ..., 'after': ...} for each top-level field that differs between two records."""
+    return {
+        field: {'before': before.get(field), 'after': after.get(field)}
+        for field in sorted(set(before) | set(after))
+        if before.get(field) != after.get(field)
+    }
+
+def is_conflict(response):
+    """True if a save was rejected because the record changed since it was fetched."""
+    if response.status_code == 409:
+        return True
+    return response.status_code == 400 and ('lock_version' in response.text or 'modified since' in response.text)
+
+def reload_record(ao_json, uri):
+    """Replace ao_json's contents in place with the current version of the record."""
+    fresh = aspace_client.get_client().get(uri).json()
+    ao_json.clear()
+    ao_json.update(fresh)
+    return ao_json
+
+
+class DaoNotCreated(Exception):
+    """A change set's digital object could neither be created nor found."""
+
+
+def ensure_dao(dao, repo_id, ao_json, uri, dao_index=None):
+    """
+    URI of a digital object for the requested DAO: an existing one with the
+    same digital_object_id or file_uri if there is one, otherwise a new one.
+    """
+    if dao_index is not None:
+        existing = dao_index.find(dao['digital_object_id'], dao['file_uri'])
+    else:
+        existing = find_dao_by_digital_object_id(repo_id, dao['digital_object_id'])
+    if existing:
+        print(f"Reusing existing DAO record: {existing}")
+        return existing
+
+    dao_ref = create_new_dao(dao['file_uri'], dao['digital_object_id'], dao['title'], repo_id, ao_json, uri)
+    if dao_ref and dao_index is not None:
+        dao_index.add(dao_ref, dao['digital_object_id'], [dao['file_uri']])
+    return dao_ref
+
+def parse_batch_import_response(response):
+    """
+    (saved, errors) from a batch_imports response: saved maps each temporary
+    URI to the real one, errors lists the messages of a rejected batch.
+    """
+    try:
+        messages = response.json()
+    except ValueError:
+        # Some versions stream one JSON message per line rather than a list
+        messages = []
+        for line in response.text.splitlines():
+            line = line.strip().strip(',[]')
+            if line:
+                try:
+                    messages.append(json.loads(line))
+                except ValueError:
+                    continue
+    if isinstance(messages, dict):
+        messages = [messages]
+
+    saved = {}
+    errors = []
+    for message in messages:
+        for temp_uri, real in (message.get('saved') or {}).items():
+            saved[temp_uri] = real[0] if isinstance(real, list) else real
+        if message.get('errors'):
+            errors.extend(message['errors'] if isinstance(message['errors'], list) else [message['errors']])
+    return saved, errors
+
+def create_daos_in_batch(change_sets, repo_id, dao_index=None):
+    """
+    Create the digital objects a group of change sets asks for with one
+    batch_imports request, and set each change set's dao_ref.
+
+    Existing digital objects are reused as in ensure_dao, found in dao_index
+    or with one find_by_id request for the whole group. New records are sent
+    with temporary URIs, and the response maps those to the created records.
+
+    ArchivesSpace imports a batch in a single transaction, so if any record is
+    rejected nothing is created. Those change sets are left without a dao_ref,
+    and commit_change_set then creates each DAO on its own, which reports any
+    failure against its own archival object.
+
+    Returns:
+        int: Number of digital objects created.
+    """
+    wanted = {}
+    for change_set in change_sets:
+        if change_set.dao and not change_set.dao_ref:
+            wanted.setdefault(change_set.dao['digital_object_id'], []).append(change_set)
+    if not wanted:
+        return 0
+
+    if dao_index is not None:
+        existing = {dao_id: dao_index.find(dao_id, group[0].dao['file_uri']) for dao_id, group in wanted.items()}
+        existing = {dao_id: ref for dao_id, ref in existing.items() if ref}
+    else:
+        existing = find_daos_by_digital_object_ids(repo_id, wanted)
+    for dao_id, ref in existing.items():
+        print(f"Reusing existing DAO record: {ref}")
+        for change_set in wanted.pop(dao_id):
+            change_set.dao_ref = ref
+    if not wanted:
+        return 0
+
+    records = []
+    temp_uris = {}
+    for dao_id, group in wanted.items():
+        dao = group[0].dao
+        temp_uri = f"/repositories/{repo_id}/digital_objects/import_{uuid.uuid4()}"
+        temp_uris[temp_uri] = dao_id
+        records.append(dict(build_dao_json(dao['file_uri'], dao_id, dao['title']), uri=temp_uri))
+
+    response = aspace_client.get_client().post(f"/repositories/{repo_id}/batch_imports", json=records)
+    saved, errors = parse_batch_import_response(response) if response.status_code == 200 else ({}, [response.text])
+    if errors or not saved:
+        reason = f"{len(errors)} errors, first: {errors[0]}" if errors else f"status {response.status_code}"
+        print(f"Batch import of {len(records)} DAOs failed ({reason}); creating them one at a time.")
+        return 0
+
+    for temp_uri, dao_id in temp_uris.items():
+        dao_ref = saved.get(temp_uri)
+        if dao_ref is None:
+            continue
+        group = wanted[dao_id]
+        for change_set in group:
+            change_set.dao_ref = dao_ref
+        if dao_index is not None:
+            dao_index.add(dao_ref, dao_id, [group[0].dao['file_uri']])
+    print(f"Created {len(saved)} DAO records in one batch import.")
+    return len(saved)
+
+def commit_change_set(change_set, ao_json, repo_id, max_retries=None, dao_index=None):
+    """
+    Create the requested DAO if the record still lacks one, apply the change
+    set and save the archival object with one POST. The record's lock_version
+    is taken from the POST response so ao_json stays writable without a refetch.
+
+    If the save hits a lock_version conflict, the record is reloaded, the change
+    set is applied again to the fresh copy and the save is retried, up to
+    max_retries times (Config.conflict_retries by default).
+
+    An existing digital object is linked instead of creating a new one when
+    dao_index (or, without an index, a find_by_id lookup) finds a match.
+
+    Returns:
+        list: Names of the parts of the record that changed (empty if no save).
+
+    Raises:
+        DaoNotCreated: If the record needs a DAO and none could be created or
+                       found; nothing is saved, so the next run tries again.
+        requests.HTTPError: If the save fails for any other reason, or the
+                            conflict persists after max_retries.
+    """
+    uri = change_set.uri
+    max_retries = Config.conflict_retries if max_retries is None else max_retries
+
+    if change_set.dao and not change_set.dao_ref and get_digital_object_instance(ao_json) is None:
+        with instrumentation.phase('dao_create'):
+            change_set.dao_ref = ensure_dao(change_set.dao, repo_id, ao_json, uri, dao_index)
+        if not change_set.dao_ref:
+            raise DaoNotCreated(f"Could not create or find a digital object for {uri}")
+
+    for attempt in range(max_retries + 1):
+        changed = change_set.changed = change_set.apply(ao_json)
+        if not changed:
+            print(f"No changes detected for {uri}. Skipping save.")
+            return changed
+
+        print(f"Update triggered for {uri} by: {', '.join(changed)}")
+        with instrumentation.phase('ao_write'):
+            response = aspace_client.get_client().post(uri, json=ao_json)
+        print(f"Updated archival object {uri}: {response.status_code}")
+
         if response.status_code == 200:
-            print(f"Updated parent AO {ancestor_json['uri']} with expanded date range.")
-        else:
-            print(f"Failed to update parent AO {ancestor_json['uri']}. Status: {response.status_code}")
-            print(response.text)
+            ao_json['lock_version'] = response.json().get('lock_version', ao_json.get('lock_version'))
+            # The object may also be cached as another record's ancestor
+            record_cache.invalidate(uri)
+            return changed
+        if not is_conflict(response) or attempt == max_retries:
+            print(f"Response text: {response.text}")
+            response.raise_for_status()
+            return changed
 
-    return needs_update
+        print(f"Conflict saving {uri}; reloading and re-applying changes (retry {attempt + 1} of {max_retries}).")
+        reload_record(ao_json, uri)
+
+    return changed
+
+def get_ancestor_refs(child_json):
+    """
+    URIs of every ancestor of an archival object, nearest first, ending with
+    the resource. Uses the record's `ancestors` list when present and falls
+    back to the parent and resource refs.
+    """
+    refs = [a['ref'] for a in child_json.get('ancestors', []) if a.get('ref')]
+    if not refs:
+        refs = [
+            ref for ref in (
+                child_json.get('parent', {}).get('ref'),
+                child_json.get('resource', {}).get('ref'),
+            ) if ref
+        ]
+    return refs
+
+def is_resource_uri(uri):
+    return '/resources/' in uri
+
+class AncestorRollup:
+    """
+    Collects the widest child date range per ancestor over a whole run so that
+    each ancestor is fetched once and written at most once, by flush().
+
+    Archival object ancestors get full dates; resources get years, as before.
+    """
+
+    def __init__(self):
+        self.ranges = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def expand(self, uri, begin, end):
+        with self.lock:
+            current = self.ranges.get(uri)
+            if current is None:
+                self.ranges[uri] = [begin, end]
+                return
+            if begin and (not current[0] or begin < current[0]):
+                current[0] = begin
+            if end and (not current[1] or end > current[1]):
+                current[1] = end
+
+    def add(self, child_json, begin_date, end_date):
+        """Record a child's capture dates against its full ancestor chain."""
+        self.add_refs(get_ancestor_refs(child_json), begin_date, end_date)
+
+    def add_refs(self, ancestor_refs, begin_date, end_date):
+        for uri in ancestor_refs:
+            if is_resource_uri(uri):
+                self.expand(uri, begin_date[:4] if begin_date else None, end_date[:4] if end_date else None)
+            else:
+                self.expand(uri, begin_date, end_date)
+
+    def update_ancestor(self, uri, begin, end, max_retries=None):
+        """
+        Widen one ancestor's dates, re-reading it if the save hits a conflict.
+
+        Returns:
+            True if the ancestor was saved, False if its dates already covered
+            the range, or None if the save failed.
+        """
+        max_retries = Config.conflict_retries if max_retries is None else max_retries
+        for attempt in range(max_retries + 1):
+            # Widen a copy, so a save that fails leaves the cached record as it was
+            ancestor_json = copy.deepcopy(get_record(uri))
+            if not expand_ancestor_dates(ancestor_json, begin, end):
+                return False
+            response = save_ancestor(ancestor_json)
+            if response.status_code == 200:
+                return True
+            if not is_conflict(response):
+                return None
+            print(f"Conflict saving {uri}; re-reading and retrying.")
+        return None
+
+    def merge(self, ranges):
+        """Fold in ranges collected by another run, e.g. a shard's ancestor_ranges."""
+        for uri, (begin, end) in ranges.items():
+            self.expand(uri, begin, end)
+
+    def plan(self):
+        """
+        The writes flush() would make, without making them: one dict per
+        ancestor whose dates would widen, with the range and a field diff.
+        """
+        planned = []
+        for uri, (begin, end) in sorted(self.ranges.items()):
+            before = get_record(uri)
+            after = copy.deepcopy(before)
+            if expand_ancestor_dates(after, begin, end):
+                planned.append({
+                    'uri': uri,
+                    'begin': begin,
+                    'end': end,
+                    'lock_version': before.get('lock_version'),
+                    'diff': diff_fields(before, after),
+                })
+        print(f"Checked {len(self.ranges)} ancestors, {len(planned)} would be updated.")
+        return planned
+
+    def flush(self):
+        """
+        Fetch each collected ancestor once and widen its dates if needed.
+        Ancestors that could not be saved are left in ranges, so the caller
+        can keep them for a later run.
+
+        Returns:
+            int: Number of ancestors that were updated.
+        """
+        updated = 0
+        failed = {}
+        for uri, (begin, end) in sorted(self.ranges.items()):
+            with instrumentation.phase('ancestor_update'):
+                try:
+                    result = self.update_ancestor(uri, begin, end)
+                except Exception as e:
+                    print(f"Failed to update ancestor {uri}: {e}")
+                    result = None
+            if result is None:
+                failed[uri] = [begin, end]
+            elif result:
+                updated += 1
+        print(f"Checked {len(self.ranges)} ancestors, updated {updated}"
+              + (f", {len(failed)} could not be saved." if failed else "."))
+        self.ranges = failed
+        return updated
 
 def makeMultiNote(obj_dict, note_type, text, label=None):
     note = {
@@ -3,127 +3,578 @@ from requests.auth import HTTPBasicAuth
 from datetime import datetime
 from urllib.parse import urlparse
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import threading
 import tldextract
 from config import Config
+import state_store
+import http_client
+import url_canon
+import instrumentation
 
 # Archive-It API credentials
 USERNAME = Config.AI_user
 PASSWORD = Config.AI_pass
+AUTH = HTTPBasicAuth(USERNAME, PASSWORD)
 
 # Partner API endpoint
 SEED_API_URL = 'https://partner.archive-it.org/api/seed'
 SEED_PARAMS = {'sort': 'created_date', 'limit': -1}
 
+# Wayback replay and CDX host
+WAYBACK_URL = 'https://wayback.archive-it.org'
+
+# Public suffix rules from the snapshot bundled with tldextract, never fetched
+# over the network; the list is parsed on the first extract_domain call
+TLD_EXTRACT = tldextract.TLDExtract(suffix_list_urls=())
+
+
+def fetch_seeds(params=None):
+    """
+    Download seeds from the partner API. Extra params are added to SEED_PARAMS
+    (e.g. a created/modified date filter). Raises requests.RequestException.
+    """
+    query = dict(SEED_PARAMS, **(params or {}))
+    response = http_client.get(SEED_API_URL, auth=AUTH, params=query)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_all_seeds(store=None, refresh=False):
+    """
+    Return every seed for the account, served from the local seed cache.
+
+    The cache is used as-is while it is younger than Config.seed_cache_ttl.
+    After that only seeds created or modified since the last sync are
+    requested. The full list is downloaded only on a cold cache or when
+    refresh is True.
+
+    Args:
+        store: A state_store.StateStore; one is opened if not given.
+        refresh: Force a full download of the seed list.
+
+    Returns:
+        iterator: Seed records in created_date order, read from the cache as
+                  they are consumed. Pass the same store to build_seed_index
+                  so get_seed_metadata can load the rest of a seed on demand.
+    """
+    store = store or state_store.StateStore()
+    age = store.seeds_age()
+    since = store.get_meta('seeds_high_water')
 
-def get_all_seeds():
     try:
-        response = requests.get(SEED_API_URL, auth=HTTPBasicAuth(USERNAME, PASSWORD), params=SEED_PARAMS)
-        response.raise_for_status()
-        return response.json()
+        if refresh or age is None or not since or store.seed_count() == 0:
+            print("Downloading full seed list from Archive-It.")
+            store.save_seeds(fetch_seeds(), replace=True)
+        elif age > Config.seed_cache_ttl:
+            changed = fetch_seeds({'created_date__gte': since})
+            changed += fetch_seeds({'last_updated_date__gte': since})
+            print(f"Refreshed {len(changed)} new or modified seeds since {since}.")
+            store.save_seeds(changed)
     except requests.RequestException as e:
-        print(f"Error fetching seeds: {e}")
-        return []
+        if store.seed_count() == 0:
+            raise
+        print(f"Error fetching seeds, using cached seeds: {e}")
+
+    return iter_cached_seeds(store)
+
+
+def iter_cached_seeds(store):
+    collections = {}
+    for seed_id, url, canonical_url, collection, created_date in store.iter_seed_rows():
+        # Thousands of seeds share a handful of collection ids; keep one object per id
+        collection = collections.setdefault(collection, collection)
+        yield Seed(seed_id, url, canonical_url, collection, created_date)
+
+
+def measure_seed_memory(store):
+    """
+    Memory the cached seeds take as Seed records against as decoded partner
+    API dicts, the form the sync used to hold for the whole run.
+
+    Both are built once under tracemalloc, so this decodes every cached seed
+    and briefly needs the memory it reports as saved.
+
+    Returns:
+        dict: seeds, dicts_mb, records_mb and saved_mb, for the run summary.
+    """
+    dicts = instrumentation.traced_bytes(store.load_seeds) / 2**20
+    records = instrumentation.traced_bytes(lambda: list(iter_cached_seeds(store))) / 2**20
+    return {'seeds': store.seed_count(), 'dicts_mb': round(dicts, 1),
+            'records_mb': round(records, 1), 'saved_mb': round(dicts - records, 1)}
+
+
+class Seed:
+    """
+    The fields of a partner API seed the sync reads. The nested metadata
+    (title, description, ...) is left in the seed cache and loaded by
+    get_seed_metadata only when asked for.
+    """
+
+    __slots__ = ('id', 'url', 'canonical_url', 'collection', 'created_date')
+
+    def __init__(self, seed_id, url, canonical_url, collection, created_date=None):
+        self.id = seed_id
+        self.url = url or ''
+        self.canonical_url = canonical_url or ''
+        self.collection = collection
+        self.created_date = created_date
+
+    @classmethod
+    def from_dict(cls, seed):
+        return cls(seed.get('id'), seed.get('url'), seed.get('canonical_url'),
+                   seed.get('collection'), seed.get('created_date'))
+
 
+class SeedIndex:
+    """
+    Lookup tables over the partner API seed list, built once per run so that
+    matching a note URL to a seed does not rescan every seed.
 
-def find_seed_by_url(seeds, target_url):
-    return next((s for s in seeds if s.get('url') == target_url), None)
+    Args:
+        seeds: Seed records from get_all_seeds(), or partner API seed dicts.
+        store: The state_store.StateStore the seeds came from, used to load
+               full seed metadata on demand.
+    """
 
+    def __init__(self, seeds, store=None):
+        self.store = store
+        self.by_url = {}
+        self.by_key = {}
+        self.domain_collections = {}
+        self.collections = {}
+        for seed in seeds:
+            self.add(seed)
 
+    def __len__(self):
+        return len(self.by_url)
+
+    def add(self, seed):
+        if isinstance(seed, dict):
+            seed = Seed.from_dict(seed)
+            seed.collection = self.collections.setdefault(seed.collection, seed.collection)
+        # setdefault keeps the first seed seen, matching the old linear scans
+        url = seed.url
+        canonical_url = seed.canonical_url
+        if url:
+            self.by_url.setdefault(url, seed)
+            domain = extract_domain(url)
+            self.domain_collections.setdefault(domain, Counter())[seed.collection] += 1
+        for key in (url, canonical_url):
+            if key:
+                self.by_key.setdefault(url_canon.canonicalize(key), seed)
+
+    def find_seed(self, target_url):
+        """Exact match on the seed URL."""
+        return self.by_url.get(target_url)
+
+    def find_normalized(self, target_url):
+        """Match on the canonical form (url_canon) of the seed or canonical URL."""
+        return self.by_key.get(url_canon.canonicalize(target_url))
+
+    def resolve_collection(self, target_url):
+        """
+        Collection for a note URL: from its seed if there is one, matched
+        exactly or after canonicalization, otherwise inferred from seeds on
+        the same domain.
+
+        Returns:
+            tuple: (collection_id, how) where how is 'exact', 'canonical',
+                   'inferred' or None.
+        """
+        seed = self.find_seed(target_url)
+        if seed:
+            return seed.collection, 'exact'
+        seed = self.find_normalized(target_url)
+        if seed:
+            return seed.collection, 'canonical'
+        collection_id = self.infer_collection(target_url)
+        if collection_id:
+            return collection_id, 'inferred'
+        return None, None
+
+    def infer_collection(self, target_url):
+        """Most common collection among seeds on the same registered domain."""
+        counts = self.domain_collections.get(extract_domain(target_url))
+        if not counts:
+            return None
+        most_common = counts.most_common(1)
+        return most_common[0][0] if most_common else None
+
+    def details(self, seed):
+        """The full partner API dict for a seed, loaded from the seed cache."""
+        if self.store is None:
+            return {}
+        return self.store.get_seed(seed.id) or {}
+
+
+def build_seed_index(seeds, store=None):
+    return SeedIndex(seeds, store)
+
+
+@lru_cache(maxsize=url_canon.CACHE_SIZE)
 def extract_domain(url):
-    ext = tldextract.extract(url)
+    ext = TLD_EXTRACT(url)
     return f"{ext.domain}.{ext.suffix}"
 
 
-def infer_collection_from_similar_seeds(seeds, target_url):
-    target_domain = extract_domain(target_url)
-    similar = [s for s in seeds if extract_domain(s['url']) == target_domain]
-    
-    if not similar:
+def _timestamp_to_date(timestamp):
+    return datetime.strptime(timestamp, "%Y%m%d%H%M%S").date().isoformat()
+
+
+class CdxSummary:
+    """
+    Constant-size aggregate of a CDX timemap: the earliest and latest capture
+    timestamps, the number of captures and the total of their `length` fields.
+    """
+
+    __slots__ = ('earliest', 'latest', 'count', 'total_bytes')
+
+    def __init__(self, earliest=None, latest=None, count=0, total_bytes=0):
+        self.earliest = earliest
+        self.latest = latest
+        self.count = count
+        self.total_bytes = total_bytes
+
+    def __bool__(self):
+        return self.count > 0
+
+    def __eq__(self, other):
+        return isinstance(other, CdxSummary) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return f"CdxSummary({self.earliest}, {self.latest}, count={self.count}, total_bytes={self.total_bytes})"
+
+    def add(self, timestamp, length=0):
+        if self.earliest is None or timestamp < self.earliest:
+            self.earliest = timestamp
+        if self.latest is None or timestamp > self.latest:
+            self.latest = timestamp
+        self.count += 1
+        self.total_bytes += length
+
+    def merge(self, other):
+        """Fold another summary (e.g. captures since the last sync) into this one."""
+        if other.earliest is not None and (self.earliest is None or other.earliest < self.earliest):
+            self.earliest = other.earliest
+        if other.latest is not None and (self.latest is None or other.latest > self.latest):
+            self.latest = other.latest
+        self.count += other.count
+        self.total_bytes += other.total_bytes
+        return self
+
+    @property
+    def begin_date(self):
+        return _timestamp_to_date(self.earliest) if self.earliest else None
+
+    @property
+    def end_date(self):
+        return _timestamp_to_date(self.latest) if self.latest else None
+
+    def as_dict(self):
+        return {
+            'earliest': self.earliest,
+            'latest': self.latest,
+            'count': self.count,
+            'total_bytes': self.total_bytes,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('earliest'), data.get('latest'), data.get('count', 0), data.get('total_bytes', 0))
+
+
+def parse_cdx_line(line):
+    """
+    Split a `timestamp length [digest]` CDX line into (timestamp, length, digest);
+    digest is None when not requested. Returns None for malformed lines.
+    """
+    parts = line.split()
+    if len(parts) not in (2, 3):
         return None
+    timestamp, length = parts[:2]
+    digest = parts[2] if len(parts) == 3 else None
+    return timestamp, int(length) if length.isdigit() else 0, digest
+
 
-    # Count collections in similar seeds
-    collections = [s['collection'] for s in similar]
-    most_common = Counter(collections).most_common(1)
-    return most_common[0][0] if most_common else None
+class CdxParamUnsupported(Exception):
+    """The CDX server rejected or ignored a server-side reduction parameter."""
 
 
-def fetch_cdx_records(collection_id, url):
-    endpoint = f"https://wayback.archive-it.org/{collection_id}/timemap/cdx"
-    params = {"url": url, "fl": "timestamp,length"}
+# Set once the CDX server has been seen not to support collapse/limit=-1,
+# so later URLs go straight to full streaming
+_cdx_reduce_unsupported = False
 
+
+def _iter_counted_lines(response, chunk_size=8192):
+    """
+    Decoded lines of a streamed response. A chunked response has no
+    Content-Length for the instrumentation hook to count, so its bytes are
+    counted here as they are read.
+    """
+    nbytes = 0
+    pending = b''
     try:
-        response = requests.get(endpoint, params=params)
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            nbytes += len(chunk)
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line.decode(response.encoding or 'utf-8').rstrip('\r')
+        if pending:
+            yield pending.decode(response.encoding or 'utf-8').rstrip('\r')
+    finally:
+        if 'Content-Length' not in response.headers:
+            instrumentation.record_bytes(instrumentation.classify('GET', response.url), nbytes)
+
+
+def _stream_cdx(collection_id, url, params, since, distinct):
+    """
+    Stream CDX lines into a CdxSummary. With distinct, consecutive captures
+    with the same digest are counted once, whether or not the server has
+    already collapsed them.
+    """
+    endpoint = f"{WAYBACK_URL}/{collection_id}/timemap/cdx"
+    params = dict(params, url=url, fl="timestamp,length,digest" if distinct else "timestamp,length")
+    if since:
+        params["from"] = since
+    summary = CdxSummary()
+    previous_digest = None
+
+    with http_client.get(endpoint, params=params, stream=True) as response:
+        if response.status_code == 400 and params.get("collapse"):
+            raise CdxParamUnsupported(f"collapse rejected with status {response.status_code}")
         response.raise_for_status()
-        lines = response.text.strip().splitlines()
-        return [tuple(line.split()) for line in lines if len(line.split()) == 2]
-    except requests.RequestException as e:
-        print(f"Error querying CDX API: {e}")
-        return []
+        for line in _iter_counted_lines(response):
+            parsed = parse_cdx_line(line)
+            if not parsed:
+                continue
+            timestamp, length, digest = parsed
+            duplicate = distinct and digest is not None and digest == previous_digest
+            previous_digest = digest
+            # `from` is inclusive, so drop the capture already counted
+            if since and timestamp <= since:
+                continue
+            if duplicate:
+                # Not counted, but still the most recent capture seen
+                if summary.latest is None or timestamp > summary.latest:
+                    summary.latest = timestamp
+                continue
+            summary.add(timestamp, length)
+
+    return summary
+
+
+def fetch_cdx_latest(collection_id, url):
+    """
+    Timestamp of the most recent capture of a URL from a one-line `limit=-1`
+    query, or None if there are no captures.
+
+    Raises:
+        CdxParamUnsupported: If the server does not honour a negative limit.
+    """
+    endpoint = f"{WAYBACK_URL}/{collection_id}/timemap/cdx"
+    response = http_client.get(endpoint, params={"url": url, "fl": "timestamp", "limit": -1})
+    if response.status_code == 400:
+        raise CdxParamUnsupported(f"limit=-1 rejected with status {response.status_code}")
+    response.raise_for_status()
+    lines = [line for line in response.text.splitlines() if line.strip()]
+    if len(lines) > 1:
+        raise CdxParamUnsupported("limit=-1 returned more than one capture")
+    return lines[0].split()[0] if lines else None
+
+
+def fetch_cdx_summary(collection_id, url, since=None, distinct=None):
+    """
+    Summarize the CDX timemap for a URL, streaming it line by line without
+    holding the response body or the capture list in memory.
+
+    Counting distinct captures (Config.extent_count = "distinct") lets the
+    server collapse runs of unchanged captures by digest, so only one line
+    per change is transferred. Collapsing hides the last capture of the final
+    run, so the latest timestamp then comes from a one-line `limit=-1` query,
+    also made for an incremental query that found no new distinct captures.
+    If the server does not support either parameter, the full timemap is
+    streamed and collapsed here instead.
+
+    Args:
+        collection_id: Archive-It collection to query.
+        url: The captured URL.
+        since: Optional 14-digit timestamp; only captures after it are counted.
+        distinct: Count distinct rather than raw captures. Defaults to
+                  Config.extent_count == "distinct".
+
+    Raises:
+        requests.RequestException: If the request still fails after retries.
+    """
+    global _cdx_reduce_unsupported
+    if distinct is None:
+        distinct = getattr(Config, 'extent_count', 'captures') == 'distinct'
+
+    if distinct and Config.cdx_server_collapse and not _cdx_reduce_unsupported:
+        try:
+            summary = _stream_cdx(collection_id, url, {"collapse": "digest"}, since, distinct)
+            # Asked even when nothing new was counted: captures repeating the
+            # content already seen are collapsed away, but still move the end date
+            if summary or since:
+                latest = fetch_cdx_latest(collection_id, url)
+                if latest and (summary.latest is None or latest > summary.latest):
+                    summary.latest = latest
+            return summary
+        except CdxParamUnsupported as e:
+            print(f"CDX server does not support collapsed queries ({e}); streaming full timemaps.")
+            _cdx_reduce_unsupported = True
+
+    return _stream_cdx(collection_id, url, {}, since, distinct)
 
 
-def get_earliest_date(records):
-    timestamps = sorted(ts for ts, _ in records)
-    return datetime.strptime(timestamps[0], "%Y%m%d%H%M%S").date().isoformat() if timestamps else None
+def cdx_extent_count_changed(store):
+    """True if stored CDX summaries were counted under another Config.extent_count."""
+    return store.get_meta('cdx_extent_count', 'captures') != getattr(Config, 'extent_count', 'captures')
 
 
-def get_latest_date(records):
-    timestamps = sorted(ts for ts, _ in records)
-    return datetime.strptime(timestamps[-1], "%Y%m%d%H%M%S").date().isoformat() if timestamps else None
+def get_cdx_summary(collection_id, url, store=None, refresh=False, save=True):
+    """
+    CDX summary for a URL, fetching only captures newer than the stored
+    high-water mark and merging them into the stored summary.
 
+    Args:
+        collection_id: Archive-It collection to query.
+        url: The captured URL.
+        store: A state_store.StateStore holding previous summaries. Without
+               one (or with Config.cdx_incremental off) the full timemap is read.
+        refresh: Ignore the stored summary and re-read the full timemap.
+        save: Store the extended summary as the new high-water mark. A
+              --plan run reads the stored summaries but leaves them as they were.
+    """
+    if store is None or not Config.cdx_incremental:
+        return fetch_cdx_summary(collection_id, url)
 
-def summarize_url_activity(url, seeds):
-    seed = find_seed_by_url(seeds, url)
-    if seed:
-        collection_id = seed['collection']
+    # Counts made under the other extent semantics can't be extended
+    refresh = refresh or cdx_extent_count_changed(store)
+    stored = None if refresh else store.get_cdx_summary(collection_id, url)
+    if stored and stored['latest']:
+        summary = CdxSummary.from_dict(stored).merge(fetch_cdx_summary(collection_id, url, since=stored['latest']))
+    else:
+        summary = fetch_cdx_summary(collection_id, url)
+
+    if summary and save:
+        store.save_cdx_summary(collection_id, url, summary.as_dict())
+    return summary
+
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def _host_semaphore(url, limit):
+    host = urlparse(url).netloc
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(limit)
+        return _host_semaphores[host]
+
+
+def reset():
+    """Forget what earlier runs learned about the CDX server, e.g. after pointing at another one."""
+    global _cdx_reduce_unsupported
+    _cdx_reduce_unsupported = False
+    with _host_semaphores_lock:
+        _host_semaphores.clear()
+    extract_domain.cache_clear()
+
+
+def prefetch_cdx_summaries(pairs, max_workers=None, per_host_limit=None, store=None, refresh=False, save=True):
+    """
+    Fetch CDX summaries for many URLs concurrently.
+
+    Args:
+        pairs: Iterable of (collection_id, url) tuples; duplicates are fetched once.
+        store: Optional state_store.StateStore for incremental queries.
+        refresh: Re-read full timemaps instead of querying incrementally.
+        save: Store the summaries (and the extent_count they were counted
+              under) for the next run's incremental queries.
+        max_workers: Thread pool size. Defaults to Config.cdx_workers.
+        per_host_limit: Maximum in-flight requests per host. Defaults to
+                        Config.cdx_per_host_limit.
+
+    Returns:
+        dict: (collection_id, url) -> CdxSummary, for the pairs that succeeded.
+    """
+    max_workers = max_workers or Config.cdx_workers
+    per_host_limit = per_host_limit or Config.cdx_per_host_limit
+    semaphore = _host_semaphore(WAYBACK_URL, per_host_limit)
+
+    def fetch(pair):
+        with semaphore, instrumentation.phase('cdx_fetch'):
+            try:
+                return get_cdx_summary(*pair, store=store, refresh=refresh, save=save)
+            except requests.RequestException as e:
+                print(f"Error prefetching CDX data for {pair[1]}: {e}")
+                return None
+
+    unique_pairs = list(dict.fromkeys(pairs))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = zip(unique_pairs, pool.map(fetch, unique_pairs))
+        # Failed pairs are left out so the object fetches (and reports) them itself
+        summaries = {pair: summary for pair, summary in results if summary is not None}
+
+    if save and store is not None and cdx_extent_count_changed(store) and len(summaries) == len(unique_pairs):
+        store.set_meta('cdx_extent_count', getattr(Config, 'extent_count', 'captures'))
+    return summaries
+
+
+def summarize_url_activity(url, seed_index):
+    collection_id, how = seed_index.resolve_collection(url)
+    if how in ('exact', 'canonical'):
         print(f"Found seed for URL in collection {collection_id}")
     else:
         print(f"No seed found for URL: {url}")
-        collection_id = infer_collection_from_similar_seeds(seeds, url)
         if collection_id:
             print(f"Inferred collection: {collection_id}")
         else:
             print("Could not infer collection — skipping")
             return
 
-    records = fetch_cdx_records(collection_id, url)
-    if not records:
+    summary = fetch_cdx_summary(collection_id, url)
+    if not summary:
         print("No CDX records found.")
         return
 
-    print(f"Begin Date: {get_earliest_date(records)}")
-    print(f"End Date:   {get_latest_date(records)}")
-    print(f"Extent:     {len(records)} crawls")
+    print(f"Begin Date: {summary.begin_date}")
+    print(f"End Date:   {summary.end_date}")
+    print(f"Extent:     {summary.count} crawls")
 
 def build_wayback_url(collection_id, url):
-    return f"https://wayback.archive-it.org/{collection_id}/*/{url}"
-
-def get_seed_metadata(seeds, target_url):
-    target = target_url.rstrip('/')
-    for seed in seeds:
-        seed_url = seed.get('url', '').rstrip('/')
-        canonical_url = seed.get('canonical_url', '').rstrip('/')
-
-        if target in {seed_url, canonical_url}:
-            metadata = seed.get('metadata', {})
-            title = metadata.get('Title', [{}])[0].get('value', '')
-            description = metadata.get('Description', [{}])[0].get('value', '')
-
-            return {
-                'seed_id': seed.get('id'),
-                'url': seed_url,
-                'canonical_url': canonical_url,
-                'collection': seed.get('collection'),
-                'title': title,
-                'description': description,
-                'created_date': seed.get('created_date'),
-                'collector': seed.get('Collector'),
-                'langauge': seed.get('Langauge'),
-            }
-    return None
+    return f"{WAYBACK_URL}/{collection_id}/*/{url}"
+
+def get_seed_metadata(seed_index, target_url):
+    seed = seed_index.find_normalized(target_url)
+    if seed is None:
+        return None
+
+    details = seed_index.details(seed)
+    metadata = details.get('metadata', {})
+    title = metadata.get('Title', [{}])[0].get('value', '')
+    description = metadata.get('Description', [{}])[0].get('value', '')
+
+    return {
+        'seed_id': seed.id,
+        'url': seed.url.rstrip('/'),
+        'canonical_url': seed.canonical_url.rstrip('/'),
+        'collection': seed.collection,
+        'title': title,
+        'description': description,
+        'created_date': seed.created_date,
+        'collector': details.get('Collector'),
+        'langauge': details.get('Langauge'),
+    }
 
 
 if __name__ == "__main__":
     target_url = input("Enter the URL to analyze: ").strip()
-    seeds = get_all_seeds()
-    summarize_url_activity(target_url, seeds)
-    print(get_seed_metadata(seeds, target_url))
\ No newline at end of file
+    store = state_store.StateStore()
+    seed_index = build_seed_index(get_all_seeds(store), store)
+    summarize_url_activity(target_url, seed_index)
+    print(get_seed_metadata(seed_index, target_url))
\ No newline at end of file
@@ -0,0 +1,260 @@
+import argparse
+import contextlib
+import importlib
+import io
+import random
+import tempfile
+import time
+import tracemalloc
+
+import requests
+
+import aspace_client
+import aspace_tools
+import at_tools
+import http_client
+import instrumentation
+import state_store
+import stub_servers
+import url_canon
+from config import Config
+
+
+def make_synthetic_seeds(count, collections=20, seed=0):
+    """
+    Build partner-API-shaped seed dicts for benchmarking.
+
+    Roughly ten seeds share each registered domain so that the domain
+    inference path has realistic collection counts to work with.
+    """
+    rng = random.Random(seed)
+    seeds = []
+    for i in range(count):
+        domain = f"site{i // 10}.example.org"
+        url = f"https://{domain}/page/{i}/"
+        seeds.append({
+            'id': i,
+            'url': url,
+            'canonical_url': f"http://{domain}/page/{i}",
+            'collection': 10000 + rng.randrange(collections),
+            'created_date': f"2020-01-01T00:00:{i % 60:02d}Z",
+            'last_updated_date': '2021-06-01T12:00:00Z',
+            'active': True,
+            'deleted': False,
+            'publicly_visible': True,
+            'seed_type': 'normal',
+            'crawl_definition': 30000 + i % 50,
+            'created_by': 'synthetic',
+            'last_updated_by': 'synthetic',
+            'login_username': None,
+            'login_password': None,
+            'seed_groups': [],
+            'metadata': {
+                'Title': [{'id': i * 3, 'value': f"Synthetic seed {i}"}],
+                'Description': [{'id': i * 3 + 1, 'value': f"Synthetic description of the web site at {url}"}],
+                'Language': [{'id': i * 3 + 2, 'value': 'English'}],
+            },
+        })
+    return seeds
+
+
+def time_lookups(func, urls):
+    start = time.perf_counter()
+    for url in urls:
+        func(url)
+    elapsed = time.perf_counter() - start
+    return elapsed / len(urls) * 1e6
+
+
+def bench_seed_index(sizes, lookups):
+    print(f"{'seeds':>8} {'build (s)':>10} {'exact (us)':>11} {'normalized (us)':>16} {'inferred (us)':>14}")
+    for size in sizes:
+        seeds = make_synthetic_seeds(size)
+        rng = random.Random(size)
+        sample = [rng.choice(seeds) for _ in range(lookups)]
+        exact_urls = [s['url'] for s in sample]
+        normalized_urls = [s['canonical_url'] + '/' for s in sample]
+        inferred_urls = [f"https://{s['url'].split('/')[2]}/unseen" for s in sample]
+
+        start = time.perf_counter()
+        index = at_tools.build_seed_index(seeds)
+        build = time.perf_counter() - start
+
+        exact = time_lookups(index.find_seed, exact_urls)
+        normalized = time_lookups(index.find_normalized, normalized_urls)
+        inferred = time_lookups(index.infer_collection, inferred_urls)
+        print(f"{size:>8} {build:>10.2f} {exact:>11.2f} {normalized:>16.2f} {inferred:>14.2f}")
+
+
+def bench_seed_memory(sizes):
+    print(f"{'seeds':>8} {'dicts (MB)':>11} {'records (MB)':>13} {'saved (MB)':>11} {'index (MB)':>11}")
+    at_tools.extract_domain('https://example.org/')  # parse the suffix list outside the measurements
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = state_store.StateStore(f"{tmp}/seeds.sqlite3")
+            store.save_seeds(make_synthetic_seeds(size), replace=True)
+
+            memory = at_tools.measure_seed_memory(store)
+            index = instrumentation.traced_bytes(
+                lambda: at_tools.build_seed_index(at_tools.iter_cached_seeds(store), store)
+            ) / 2**20
+            store.close()
+        print(f"{size:>8} {memory['dicts_mb']:>11.1f} {memory['records_mb']:>13.1f} {memory['saved_mb']:>11.1f} {index:>11.1f}")
+
+
+def configure_for_stubs(base_url, state_db):
+    """Point the sync at the local stand-ins; must run before main is imported."""
+    Config.aspace_host = base_url
+    Config.aspace_user = 'benchmark'
+    Config.aspace_pass = 'benchmark'
+    Config.aspace_repo = stub_servers.REPO_ID
+    Config.state_db = state_db
+    at_tools.SEED_API_URL = f"{base_url}/api/seed"
+    at_tools.WAYBACK_URL = base_url
+
+
+def reset_sync_state():
+    """
+    Drop module-level state left by an earlier run, so each benchmark size
+    starts with no client, session, cached records or counters.
+    """
+    aspace_client.reset()
+    http_client.reset()
+    at_tools.reset()
+    aspace_tools.record_cache.clear()
+    url_canon.canonicalize.cache_clear()
+    instrumentation.reset()
+
+
+def stub_counters(base_url):
+    return requests.get(f"{base_url}/__stats").json()
+
+
+def run_quietly(verbose, func, *args):
+    if verbose:
+        return func(*args)
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+
+def bench_sync(sizes, captures, aspace_latency, cdx_latency, singles, port, trace_memory, verbose):
+    base_url = f"http://127.0.0.1:{port}"
+    print(f"{'objects':>8} {'seconds':>9} {'objects/s':>10} {'HTTP/object':>12} {'peak MB':>8} {'refid (s)':>10}  calls")
+
+    for size in sizes:
+        servers = stub_servers.start(port, size, captures, aspace_latency, cdx_latency)
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                configure_for_stubs(base_url, f"{tmp}/state.sqlite3")
+                reset_sync_state()
+                main = importlib.import_module('main')
+
+                if trace_memory:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                run_quietly(verbose, main.update_all_webarchive_aos)
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1] / 2**20 if trace_memory else float('nan')
+                if trace_memory:
+                    tracemalloc.stop()
+                calls = stub_counters(base_url)
+
+                refids = [f"bench{i:08d}" for i in random.Random(size).sample(range(size), min(singles, size))]
+                start = time.perf_counter()
+                for refid in refids:
+                    run_quietly(verbose, main.update_single_archival_object, refid)
+                single = (time.perf_counter() - start) / len(refids) if refids else float('nan')
+        finally:
+            servers.terminate()
+            servers.join()
+
+        total_calls = sum(calls.values())
+        breakdown = ', '.join(f"{name}={count / size:.2f}" for name, count in sorted(calls.items()))
+        print(
+            f"{size:>8} {elapsed:>9.2f} {size / elapsed:>10.1f} {total_calls / size:>12.2f} "
+            f"{peak:>8.1f} {single:>10.3f}  {breakdown}"
+        )
+
+
+# (captures at the first sync, captures at the second), including growth
+# that only repeats the last page content and growth that changes it
+CDX_CHECK_STEPS = ((18, 20), (16, 17), (20, 26), (8, 9), (12, 12))
+
+
+def check_cdx_incremental(port, steps=CDX_CHECK_STEPS):
+    """
+    Regression check: for each extent_count mode, a CDX summary extended
+    incrementally after new captures must equal one read in full.
+
+    Returns:
+        int: Number of mismatches (0 if every case matched).
+    """
+    base_url = f"http://127.0.0.1:{port}"
+    url = stub_servers.note_url(0)
+    failures = 0
+    saved = (Config.extent_count, Config.cdx_incremental)
+    try:
+        for mode in ('captures', 'distinct'):
+            Config.extent_count = mode
+            Config.cdx_incremental = True
+            for before, after in steps:
+                with tempfile.TemporaryDirectory() as tmp:
+                    configure_for_stubs(base_url, f"{tmp}/state.sqlite3")
+                    reset_sync_state()
+                    store = state_store.StateStore()
+                    store.set_meta('cdx_extent_count', mode)
+                    for captures in (before, after):
+                        servers = stub_servers.start(port, 1, captures)
+                        try:
+                            incremental = at_tools.get_cdx_summary(1, url, store=store)
+                            full = at_tools.fetch_cdx_summary(1, url)
+                        finally:
+                            servers.terminate()
+                            servers.join()
+                    store.close()
+                ok = incremental == full
+                failures += not ok
+                print(f"{mode:>9} {before:>3} -> {after:<3} {'ok' if ok else 'MISMATCH'}"
+                      + ("" if ok else f"  incremental {incremental}, full {full}"))
+    finally:
+        Config.extent_count, Config.cdx_incremental = saved
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the web archives sync.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = subparsers.add_parser("seed-index", help="Seed lookup cost as the seed count grows.")
+    seed_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    seed_parser.add_argument("--lookups", type=int, default=1000)
+
+    memory_parser = subparsers.add_parser("seed-memory", help="Memory held by cached seeds as partner API dicts and as compact records.")
+    memory_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+
+    sync_parser = subparsers.add_parser("sync", help="End-to-end sync against local ArchivesSpace and Archive-It stand-ins.")
+    sync_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10000, 100000])
+    sync_parser.add_argument("--captures", type=int, default=50, help="CDX captures per URL.")
+    sync_parser.add_argument("--aspace-latency", type=float, default=0.0, help="Seconds added to each ArchivesSpace request.")
+    sync_parser.add_argument("--cdx-latency", type=float, default=0.0, help="Seconds added to each CDX request.")
+    sync_parser.add_argument("--singles", type=int, default=10, help="Number of --refid runs to time per size.")
+    sync_parser.add_argument("--port", type=int, default=8089)
+    sync_parser.add_argument("--no-memory", dest="trace_memory", action="store_false", help="Skip tracemalloc peak memory tracking.")
+    sync_parser.add_argument("--verbose", action="store_true", help="Show the sync's own output.")
+
+    cdx_parser = subparsers.add_parser("cdx-check", help="Check incremental CDX summaries against full reads as captures are added.")
+    cdx_parser.add_argument("--port", type=int, default=8089)
+
+    args = parser.parse_args()
+
+    if args.command == "seed-index":
+        bench_seed_index(args.sizes, args.lookups)
+    elif args.command == "seed-memory":
+        bench_seed_memory(args.sizes)
+    elif args.command == "cdx-check":
+        raise SystemExit(1 if check_cdx_incremental(args.port) else 0)
+    elif args.command == "sync":
+        bench_sync(
+            args.sizes, args.captures, args.aspace_latency, args.cdx_latency,
+            args.singles, args.port, args.trace_memory, args.verbose
+        )
@@ -16,6 +16,7 @@ class Config:
     phystech_label_scrc = 'Web Archives - SCRC'
     phystech_label_ia = "Web Archives - Internet Archive"
     extent_type = "web capture(s)"
+    extent_count = "captures" #"captures" counts every capture; "distinct" counts only captures whose content changed
 
     #controlled values (to post to AOs)
     data_access_label = "Access Requirements"
@@ -28,3 +29,28 @@ class Config:
 
     crawl_date_label = "Captured"
 
+    #ArchivesSpace search
+    search_page_size = 250 #archival objects per search request
+    record_cache_size = 2000 #ancestor/resource records kept in memory during a run
+    dao_index_page_size = 250 #digital objects per request when indexing existing DAOs
+    refid_chunk_size = 50 #ref_ids resolved per find_by_id request in --refid mode
+    dao_batch_size = 100 #archival objects per batch; their new DAOs are created with one batch_imports request (0 = one POST per DAO)
+
+    #Local state
+    state_db = "webarchives_state.sqlite3" #SQLite file for caches and sync state between runs
+    seed_cache_ttl = 24 * 60 * 60 #seconds before cached Archive-It seeds are refreshed
+    cdx_incremental = True #only ask the CDX server for captures newer than the last sync
+
+    #Concurrency
+    cdx_workers = 8 #threads used to prefetch CDX data in --all mode
+    cdx_per_host_limit = 4 #maximum concurrent requests to the Wayback CDX host
+    workers = 1 #archival objects processed concurrently in --all mode (--workers overrides)
+    conflict_retries = 3 #reload-and-retry attempts when a save hits a lock_version conflict
+    shard_key = "resource" #"resource" keeps each resource's objects (and ancestor roll-ups) in one --shard; or "ref_id"
+
+    #HTTP (Archive-It partner API and Wayback CDX)
+    http_timeout = 60 #seconds per request
+    http_retries = 5 #retries for connection errors, 429 and 5xx responses
+    http_backoff_factor = 0.5 #exponential backoff base in seconds; Retry-After is honored
+    cdx_server_collapse = True #let the CDX server collapse unchanged captures when extent_count = "distinct"
+
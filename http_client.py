@@ -0,0 +1,78 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import Config
+import instrumentation
+
+# Transient responses worth retrying with backoff
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    The shared keep-alive session for Archive-It requests, created on first use.
+
+    Connection pools are sized to the CDX worker count so concurrent fetches
+    reuse connections instead of opening new ones. GETs that fail with a
+    connection error or one of RETRY_STATUSES are retried with exponential
+    backoff, honoring any Retry-After header.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=Config.http_retries,
+                backoff_factor=Config.http_backoff_factor,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=frozenset(['GET', 'HEAD']),
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            pool_size = max(Config.cdx_workers, Config.cdx_per_host_limit)
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            instrumentation.install(session)
+            _session = session
+        return _session
+
+
+def reset():
+    """Close and forget the shared session, e.g. after pointing Config at another server."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def get(url, **kwargs):
+    """
+    GET through the shared session. Responses are counted by the
+    instrumentation hook; requests that never get a response are counted here.
+
+    Args:
+        url: Full request URL.
+        **kwargs: Passed to requests.Session.get.
+
+    Returns:
+        requests.Response
+    """
+    kwargs.setdefault('timeout', Config.http_timeout)
+    start = time.perf_counter()
+    try:
+        response = get_session().get(url, **kwargs)
+    except requests.RequestException:
+        instrumentation.record_http(instrumentation.classify('GET', url), 'error', 0, time.perf_counter() - start)
+        raise
+    # A chunked body has no Content-Length for the hook to count. Streamed
+    # bodies are counted by their reader (see at_tools._iter_counted_lines)
+    if not kwargs.get('stream') and 'Content-Length' not in response.headers:
+        instrumentation.record_bytes(instrumentation.classify('GET', url), len(response.content))
+    return response
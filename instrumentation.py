@@ -0,0 +1,244 @@
+import json
+import math
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Phases of a sync run, in the order they happen for one archival object
+PHASES = ('search', 'ao_fetch', 'seed_match', 'cdx_fetch', 'ao_write', 'ancestor_update', 'dao_create')
+
+_lock = threading.Lock()
+_phase_durations = {}
+_http = {}
+_counters = {}
+_local = threading.local()
+_trace_file = None
+
+
+def reset():
+    global _trace_file
+    with _lock:
+        _phase_durations.clear()
+        _http.clear()
+        _counters.clear()
+        if _trace_file:
+            _trace_file.close()
+        _trace_file = None
+
+
+def traced_bytes(build):
+    """
+    Memory still allocated by build()'s result once it returns, measured with
+    tracemalloc. Works inside an outer trace, which is left running.
+    """
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    if not tracing:
+        tracemalloc.stop()
+    del result
+    return allocated
+
+
+def open_trace(path):
+    """Write one JSON line per processed archival object to path."""
+    global _trace_file
+    with _lock:
+        _trace_file = open(path, 'a')
+
+
+@contextmanager
+def phase(name):
+    """Time a block of work under the given phase name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - start)
+
+
+def record_phase(name, seconds):
+    with _lock:
+        _phase_durations.setdefault(name, []).append(seconds)
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace['phases'][name] = trace['phases'].get(name, 0.0) + seconds
+
+
+@contextmanager
+def object_trace(uri, trace=None, emit=True):
+    """
+    Collect the phases and HTTP requests made for one archival object on this
+    thread, and emit them as a trace line if a trace file is open.
+
+    Work on one object split into stages (possibly on different threads) can
+    share a line: run the first stage with emit=False and pass the trace it
+    yields to the next. A trace that ends in an error is always emitted.
+    """
+    trace = trace or {'uri': uri, 'phases': {}, 'http_requests': 0, 'outcome': 'ok', 'seconds': 0.0}
+    _local.trace = trace
+    start = time.perf_counter()
+    try:
+        yield trace
+    except Exception as e:
+        trace['outcome'] = f"error: {e}"
+        raise
+    finally:
+        _local.trace = None
+        trace['seconds'] += time.perf_counter() - start
+        with _lock:
+            if _trace_file and (emit or trace['outcome'] != 'ok'):
+                _trace_file.write(json.dumps(trace) + '\n')
+                _trace_file.flush()
+
+
+def set_counters(name, counters):
+    """Attach a dict of named counters (e.g. cache hits) to the run summary."""
+    with _lock:
+        _counters[name] = dict(counters)
+
+
+def add_counters(name, counters):
+    """
+    Add counters into any already recorded under name, e.g. when merging
+    shard runs. Keys ending in ' rate' are recomputed from the merged counts
+    and 'max_' keys keep the largest value.
+    """
+    with _lock:
+        merged = _counters.setdefault(name, {})
+        for key, value in counters.items():
+            if key.endswith(' rate'):
+                continue
+            if key.startswith('max_'):
+                merged[key] = max(merged.get(key, 0), value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+        total = sum(value for key, value in merged.items() if not key.endswith(' rate') and not key.startswith('max_'))
+        for key in counters:
+            if key.endswith(' rate'):
+                merged[key] = round(merged.get(key[:-len(' rate')], 0) / total, 3) if total else 0.0
+
+
+def dump():
+    """Raw phase timings, HTTP accounting and counters, for merge() in another process."""
+    with _lock:
+        return {
+            'phases': {name: list(values) for name, values in _phase_durations.items()},
+            'http': {endpoint: dict(stats, statuses=dict(stats['statuses']), durations=list(stats['durations']))
+                     for endpoint, stats in _http.items()},
+            'counters': {name: dict(values) for name, values in _counters.items()},
+        }
+
+
+def merge(raw):
+    """Fold another process's dump() into this process's summary."""
+    with _lock:
+        for name, values in raw.get('phases', {}).items():
+            _phase_durations.setdefault(name, []).extend(values)
+        for endpoint, other in raw.get('http', {}).items():
+            stats = _http.setdefault(endpoint, {'requests': 0, 'bytes': 0, 'statuses': {}, 'durations': []})
+            stats['requests'] += other['requests']
+            stats['bytes'] += other['bytes']
+            for status, count in other['statuses'].items():
+                stats['statuses'][status] = stats['statuses'].get(status, 0) + count
+            stats['durations'].extend(other['durations'])
+    for name, values in raw.get('counters', {}).items():
+        add_counters(name, values)
+
+
+def classify(method, url):
+    """Endpoint name an HTTP request is counted under."""
+    if '/api/seed' in url:
+        return 'archive-it seed'
+    if '/timemap/cdx' in url:
+        return 'archive-it cdx'
+    return f"aspace {method}"
+
+
+def record_http(endpoint, status, nbytes, seconds):
+    with _lock:
+        stats = _http.setdefault(endpoint, {'requests': 0, 'bytes': 0, 'statuses': {}, 'durations': []})
+        stats['requests'] += 1
+        stats['bytes'] += nbytes
+        stats['statuses'][str(status)] = stats['statuses'].get(str(status), 0) + 1
+        stats['durations'].append(seconds)
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace['http_requests'] += 1
+
+
+def record_bytes(endpoint, nbytes):
+    """Add body bytes read from a streamed response to an endpoint already counted by the hook."""
+    with _lock:
+        stats = _http.setdefault(endpoint, {'requests': 0, 'bytes': 0, 'statuses': {}, 'durations': []})
+        stats['bytes'] += nbytes
+
+
+def _response_hook(response, *args, **kwargs):
+    # Hooks run before the body is read, so bytes come from Content-Length
+    # rather than forcing a streamed response into memory; a chunked
+    # response's bytes are added with record_bytes() as they are read
+    request = response.request
+    nbytes = int(response.headers.get('Content-Length') or 0)
+    record_http(classify(request.method, request.url), response.status_code, nbytes, response.elapsed.total_seconds())
+
+
+def install(session):
+    """Count every response made through a requests.Session."""
+    if _response_hook not in session.hooks['response']:
+        session.hooks['response'].append(_response_hook)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _latency_summary(durations):
+    values = sorted(durations)
+    return {
+        'count': len(values),
+        'total_seconds': sum(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+    }
+
+
+def summary():
+    """Machine-readable run summary: per-phase and per-endpoint latency percentiles."""
+    with _lock:
+        phases = {name: _latency_summary(values) for name, values in _phase_durations.items()}
+        http = {}
+        for endpoint, stats in _http.items():
+            http[endpoint] = dict(_latency_summary(stats['durations']),
+                                  bytes=stats['bytes'], statuses=dict(stats['statuses']))
+        counters = {name: dict(values) for name, values in _counters.items()}
+    return {'phases': phases, 'http': http, 'counters': counters}
+
+
+def write_summary(path):
+    with open(path, 'w') as f:
+        json.dump(summary(), f, indent=2)
+
+
+def print_summary():
+    data = summary()
+    ordered = [p for p in PHASES if p in data['phases']] + sorted(set(data['phases']) - set(PHASES))
+    for name in ordered:
+        s = data['phases'][name]
+        print(f"phase {name}: {s['count']} x, total {s['total_seconds']:.2f}s, "
+              f"p50 {s['p50']:.3f}s, p95 {s['p95']:.3f}s, p99 {s['p99']:.3f}s")
+    for endpoint, s in sorted(data['http'].items()):
+        statuses = ', '.join(f"{code}: {n}" for code, n in sorted(s['statuses'].items()))
+        print(f"http {endpoint}: {s['count']} requests, {s['bytes']} bytes, "
+              f"p50 {s['p50']:.3f}s, p95 {s['p95']:.3f}s, p99 {s['p99']:.3f}s ({statuses})")
+    for name, values in sorted(data['counters'].items()):
+        print(f"{name}: " + ', '.join(f"{key} {value}" for key, value in values.items()))
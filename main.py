@@ -1,158 +1,884 @@
 import argparse
-from asnake.aspace import ASpace
+import contextlib
+import copy
+import csv
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
+import aspace_client
 import aspace_tools
 import at_tools
-from datetime import datetime
+import reports
+import state_store
+import instrumentation
+import url_canon
 
-# Initialize ArchivesSpace client
-aspace = ASpace(
-    baseurl=Config.aspace_host,
-    username=Config.aspace_user,
-    password=Config.aspace_pass
-)
 
-
-def process_archival_object(obj_json, seeds, repo_id, subject):
-    uri = obj_json['uri']
-
-    notes = aspace_tools.extract_notes_by_label_or_type(
+def get_note_urls(obj_json):
+    return aspace_tools.extract_notes_by_label_or_type(
         obj_json,
         label=Config.phystech_label_scrc,
         note_type="phystech",
         label_regex=False
     )
 
-    for note_url in notes:
+
+class SyncContext:
+    """
+    State shared by every archival object in one sync run.
+
+    Args:
+        repo_id: The ArchivesSpace repository ID.
+        subject: The subject marking web archive records.
+        seed_index: at_tools.SeedIndex over the account's seeds.
+        store: state_store.StateStore for caches and sync state.
+        full: Reprocess unchanged objects and re-read full CDX timemaps.
+
+    With a ChangePlan in plan, nothing is written: each object's changes are
+    saved to the plan instead, and the run journal, sync state and stored
+    CDX summaries are left as they were.
+    """
+
+    def __init__(self, repo_id, subject, seed_index, store, full=False):
+        self.repo_id = repo_id
+        self.subject = subject
+        self.seed_index = seed_index
+        self.store = store
+        self.full = full
+        self.rollup = aspace_tools.AncestorRollup()
+        self.cdx_summaries = {}
+        self.dao_index = None
+        self.skipped = 0
+        self.failed = 0
+        self.processed = 0
+        self.defer_ancestors = False
+        self.shard = None
+        self.plan = None
+        self.matches = Counter()
+        self.lock = threading.Lock()
+
+    def count_failure(self):
+        with self.lock:
+            self.failed += 1
+
+    def count_match(self, how):
+        with self.lock:
+            self.matches[how or 'unmatched'] += 1
+
+    def match_rates(self):
+        """Note URL seed matches by kind, with each kind's share of the total."""
+        with self.lock:
+            total = sum(self.matches.values())
+            counts = {how: self.matches[how] for how in ('exact', 'canonical', 'inferred', 'unmatched')}
+        rates = {f"{how} rate": round(count / total, 3) if total else 0.0 for how, count in counts.items()}
+        return dict(counts, **rates)
+
+
+class ChangePlan:
+    """
+    A --plan file: one JSON line per intended write, for apply_plan() to make
+    later. The first line holds the repository; each archival object line
+    holds its change set, a field diff and the record it was computed from,
+    and each ancestor line the date range it would be widened to.
+
+    Args:
+        path: JSONL file to write.
+        repo_id: The ArchivesSpace repository ID.
+    """
+
+    def __init__(self, path, repo_id):
+        self.path = path
+        self.file = open(path, 'w')
+        self.lock = threading.Lock()
+        self.objects = 0
+        self.new_daos = 0
+        self.ancestors = 0
+        self.write({'type': 'plan', 'repo_id': repo_id, 'created_at': time.time()})
+
+    def write(self, entry):
+        with self.lock:
+            self.file.write(json.dumps(entry) + '\n')
+
+    def add_object(self, obj_json, change_set, dao_index=None):
+        """Record the write commit_change_set would make, by applying the change set to a copy."""
+        if change_set.dao and not change_set.dao_ref and dao_index is not None:
+            change_set.dao_ref = dao_index.find(change_set.dao['digital_object_id'], change_set.dao['file_uri'])
+        preview = copy.deepcopy(obj_json)
+        changed = change_set.changed = change_set.apply(preview)
+        new_dao = bool(change_set.dao and not change_set.dao_ref)
+        if new_dao:
+            changed.append("DAO link")
+        if not changed:
+            return
+        self.write({
+            'type': 'archival_object',
+            'uri': change_set.uri,
+            'lock_version': obj_json.get('lock_version'),
+            'changes': changed,
+            'diff': aspace_tools.diff_fields(obj_json, preview),
+            'change_set': change_set.as_dict(),
+            'ancestors': aspace_tools.get_ancestor_refs(obj_json),
+            'record': obj_json,
+        })
+        with self.lock:
+            self.objects += 1
+            self.new_daos += new_dao
+
+    def add_ancestors(self, rollup):
+        for entry in rollup.plan():
+            self.write(dict(entry, type='ancestor'))
+            self.ancestors += 1
+
+    def close(self):
+        self.file.close()
+        print(f"Wrote plan to {self.path}: {self.objects} archival objects to update, "
+              f"{self.new_daos} new DAOs, {self.ancestors} ancestors to widen.")
+
+
+def read_plan(path):
+    """(header, archival object entries, ancestor entries) from a --plan file."""
+    header = {}
+    objects = []
+    ancestors = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry['type'] == 'plan':
+                header = entry
+            elif entry['type'] == 'archival_object':
+                objects.append(entry)
+            elif entry['type'] == 'ancestor':
+                ancestors.append(entry)
+    return header, objects, ancestors
+
+
+# Config values written into each description. They are part of the notes
+# fingerprint, so changing one resyncs objects that are otherwise unchanged
+DESCRIPTION_CONFIG = ('data_access_note_scrc', 'data_access_label', 'acq_note_scrc', 'acq_note_label',
+                      'extent_type', 'crawl_date_label')
+
+
+def notes_fingerprint(note_urls):
+    config = [repr(getattr(Config, name, None)) for name in DESCRIPTION_CONFIG]
+    return hashlib.sha1('\n'.join(sorted(note_urls) + ['\0'] + config).encode()).hexdigest()
+
+
+def collect_cdx_pairs(hits, seed_index):
+    """(collection_id, note_url) for every note URL whose collection can be resolved."""
+    pairs = []
+    for hit in hits:
+        for note_url in hit.note_urls:
+            collection_id, _ = seed_index.resolve_collection(note_url)
+            if collection_id:
+                pairs.append((collection_id, note_url))
+    return pairs
+
+
+def prefetched_summaries(note_urls, ctx):
+    """note URL -> prefetched CDX summary dict, or None if any is missing."""
+    summaries = {}
+    for note_url in note_urls:
+        collection_id, _ = ctx.seed_index.resolve_collection(note_url)
+        if not collection_id:
+            continue
+        summary = ctx.cdx_summaries.get((collection_id, note_url))
+        if summary is None:
+            return None
+        summaries[note_url] = summary.as_dict()
+    return summaries
+
+
+def is_unchanged(hit, ctx):
+    """
+    True if neither the record nor the captures of its note URLs have changed
+    since the last sync recorded in the state store.
+    """
+    state = ctx.store.get_ao_state(hit.uri)
+    if state is None or state['lock_version'] != hit.lock_version:
+        return False
+    # system_mtime is unknown right after our own write; lock_version covers it
+    if state['system_mtime'] and hit.system_mtime and state['system_mtime'] != hit.system_mtime:
+        return False
+    if state['notes_fingerprint'] != notes_fingerprint(hit.note_urls):
+        return False
+    return prefetched_summaries(hit.note_urls, ctx) == state['cdx_summaries']
+
+
+def description_rows(obj_json, change_set):
+    """One row per note URL describing the archival object's web archives, for reports."""
+    instance = aspace_tools.get_digital_object_instance(obj_json)
+    dao_uri = change_set.dao_ref or (instance['digital_object'].get('ref') if instance else None)
+    rows = []
+    for note_url in get_note_urls(obj_json):
+        summary = at_tools.CdxSummary.from_dict(change_set.cdx_summaries.get(note_url) or {})
+        rows.append({
+            'note_url': note_url,
+            'ref_id': obj_json.get('ref_id'),
+            'title': obj_json.get('display_string') or obj_json.get('title'),
+            'resource': obj_json.get('resource', {}).get('ref'),
+            'collection_id': change_set.collections.get(note_url),
+            'begin_date': summary.begin_date,
+            'end_date': summary.end_date,
+            'extent': summary.count,
+            'total_bytes': summary.total_bytes,
+            'dao_uri': dao_uri,
+        })
+    return rows
+
+
+def record_sync_state(obj_json, change_set, store):
+    written = bool(change_set.changed)
+    store.save_descriptions(obj_json['uri'], description_rows(obj_json, change_set))
+    store.save_ao_state(
+        obj_json['uri'],
+        None if written else obj_json.get('system_mtime'),
+        obj_json.get('lock_version'),
+        notes_fingerprint(get_note_urls(obj_json)),
+        change_set.cdx_summaries
+    )
+
+
+def process_archival_object(obj_json, ctx):
+    """
+    Compute and save the web archive description for one archival object.
+
+    Returns:
+        aspace_tools.ChangeSet: What was computed (and applied) for the record.
+    """
+    change_set = build_change_set(obj_json, ctx)
+    save_archival_object(obj_json, change_set, ctx)
+    return change_set
+
+
+def build_change_set(obj_json, ctx):
+    """The web archive description changes for one archival object, without saving them."""
+    uri = obj_json['uri']
+    change_set = aspace_tools.ChangeSet(uri)
+
+    for note_url in get_note_urls(obj_json):
         print(f"Note (URL): {note_url}")
 
-        seed = at_tools.find_seed_by_url(seeds, note_url)
-        if seed:
-            collection_id = seed['collection']
+        with instrumentation.phase('seed_match'):
+            collection_id, how = ctx.seed_index.resolve_collection(note_url)
+        ctx.count_match(how)
+        change_set.collections[note_url] = collection_id
+        if how in ('exact', 'canonical'):
             print(f"Found collection {collection_id} for URL.")
+        elif how == 'inferred':
+            print(f"Inferred collection {collection_id} for URL.")
         else:
-            collection_id = at_tools.infer_collection_from_similar_seeds(seeds, note_url)
-            if collection_id:
-                print(f"Inferred collection {collection_id} for URL.")
-            else:
-                print("Could not determine collection for URL — skipping further processing.")
-                continue
+            print("Could not determine collection for URL — skipping further processing.")
+            continue
 
-        records = at_tools.fetch_cdx_records(collection_id, note_url)
-        if not records:
+        summary = ctx.cdx_summaries.get((collection_id, note_url))
+        if summary is None:
+            with instrumentation.phase('cdx_fetch'):
+                summary = at_tools.get_cdx_summary(
+                    collection_id, note_url, store=ctx.store, refresh=ctx.full, save=not ctx.plan
+                )
+        change_set.cdx_summaries[note_url] = summary.as_dict()
+        if not summary:
             print("No CDX records found for URL.")
             continue
 
-        begin_date = at_tools.get_earliest_date(records)
-        end_date = at_tools.get_latest_date(records)
+        begin_date = summary.begin_date
+        end_date = summary.end_date
         date_expression = f"{begin_date} - {end_date}" if end_date else begin_date
-        extent = len(records)
-
-        #these aspace_tools functions return false/true depending on if they updated anything
-        dates_changed = aspace_tools.update_dates(obj_json, begin_date, end_date, date_expression, Config.crawl_date_label)
-        extent_changed = aspace_tools.update_extent(obj_json, extent, Config)
-        note1_changed = aspace_tools.update_or_create_note(obj_json, "phystech", Config.data_access_note_scrc, Config.data_access_label)
-        note2_changed = aspace_tools.update_or_create_note(obj_json, "acqinfo", Config.acq_note_scrc, Config.acq_note_label)
-
-        # dictionary to map the change-flag to a name to help with debug
-        changes = {
-            "Dates": dates_changed,
-            "Extent": extent_changed,
-            "Note 1 (phystech)": note1_changed,
-            "Note 2 (acqinfo)": note2_changed
-        }
-
-        if any(changes.values()):
-            # Log exactly WHAT is causing the save
-            triggered_by = [name for name, status in changes.items() if status]
-            print(f"Update triggered for {uri} by: {', '.join(triggered_by)}")
-            
-            response = aspace.client.post(uri, json=obj_json)
-            print(f"Updated archival object {uri}: {response.status_code}")
-            obj_json = aspace.client.get(uri).json()  # refetch to avoid conflicts
-        else:
-            print(f"No changes detected for {uri}. Skipping save.")
-
-        # Update parent and resource record dates
-        parent_json = aspace_tools.get_parent_json(obj_json)
-        if parent_json:
-            aspace_tools.update_ancestor_dates_if_needed(parent_json, begin_date, end_date)
-
-        resource_json = aspace_tools.get_resource_json(obj_json)
-        if resource_json:
-            begin_year = datetime.strptime(begin_date, "%Y-%m-%d").year
-            end_year = datetime.strptime(end_date, "%Y-%m-%d").year
-            aspace_tools.update_ancestor_dates_if_needed(resource_json, begin_year, end_year)
-
-        # Update or create DAO
-        wayback_uri = at_tools.build_wayback_url(collection_id, note_url)
-        dao_instances = aspace_tools.get_digital_object_instance(obj_json)
-
-        if dao_instances is None:
-            print(f"No DAO attached to {uri}. Creating new DAO.")
-            dao_ref = aspace_tools.create_new_dao(
-                wayback_uri,
-                obj_json.get('ref_id'),
-                f"Web Archives Replay Calendar - {note_url}",
-                repo_id,
-                obj_json,
-                uri
-            )
-            aspace_tools.link_dao_to_ao(dao_ref, obj_json, uri)
+
+        change_set.set_capture_dates(begin_date, end_date, date_expression)
+        change_set.set_extent(summary.count)
+        change_set.add_note("phystech", Config.data_access_note_scrc, Config.data_access_label)
+        change_set.add_note("acqinfo", Config.acq_note_scrc, Config.acq_note_label)
+
+        if change_set.dao is None:
+            if aspace_tools.get_digital_object_instance(obj_json) is None:
+                print(f"No DAO attached to {uri}. Creating new DAO.")
+                change_set.set_dao(
+                    at_tools.build_wayback_url(collection_id, note_url),
+                    obj_json.get('ref_id'),
+                    f"Web Archives Replay Calendar - {note_url}"
+                )
+            else:
+                print("DAO already exists — skipping DAO creation.")
+
+    return change_set
+
+
+def save_archival_object(obj_json, change_set, ctx):
+    if ctx.plan:
+        if change_set:
+            ctx.plan.add_object(obj_json, change_set, ctx.dao_index)
+        roll_up_ancestors(obj_json, change_set, ctx)
+        return
+    # Dates, extent, notes and the DAO link all go out in one write
+    if change_set:
+        aspace_tools.commit_change_set(change_set, obj_json, ctx.repo_id, dao_index=ctx.dao_index)
+    # The object's ancestor ranges are stored before it counts as synced, so
+    # skipping it next run cannot lose them if this run never flushes
+    roll_up_ancestors(obj_json, change_set, ctx)
+    record_sync_state(obj_json, change_set, ctx.store)
+
+
+def roll_up_ancestors(obj_json, change_set, ctx):
+    """
+    Add a saved object's capture dates to the run's ancestor roll-up. Ancestor
+    dates are widened once per ancestor when the run finishes, and only for
+    children whose own dates were written. Outside a plan, the ranges are
+    also kept in the state store until flush_ancestors() has written them.
+    """
+    rollup = aspace_tools.AncestorRollup()
+    for summary in change_set.cdx_summaries.values():
+        summary = at_tools.CdxSummary.from_dict(summary)
+        if summary:
+            rollup.add(obj_json, summary.begin_date, summary.end_date)
+    ctx.rollup.merge(rollup.ranges)
+    if rollup.ranges and not ctx.plan:
+        ctx.store.add_pending_ancestors(rollup.ranges, obj_json.get('resource', {}).get('ref'))
+
+
+def flush_ancestors(rollup, store):
+    """
+    Widen the collected ancestors, then forget the pending ranges that were
+    written. Ranges whose save failed stay pending for the next run.
+    """
+    ranges = {uri: list(dates) for uri, dates in rollup.ranges.items()}
+    rollup.flush()
+    store.clear_pending_ancestors({uri: dates for uri, dates in ranges.items() if uri not in rollup.ranges})
+
+
+def record_failure(hit, ctx, error):
+    print(f"Failed to process object {hit.uri}: {error}")
+    ctx.count_failure()
+    if not ctx.plan:
+        ctx.store.record_failure(hit.uri, f"{type(error).__name__}: {error}")
+
+
+def prepare_hit(hit, ctx):
+    """
+    Fetch a hit's record and compute its change set. Returns
+    (hit, obj_json, change_set, trace) for finish_hit, or None if it failed
+    (the failure is journalled and reported).
+    """
+    try:
+        with instrumentation.object_trace(hit.uri, emit=False) as trace:
+            with instrumentation.phase('ao_fetch'):
+                obj_json = hit.json()
+            change_set = build_change_set(obj_json, ctx)
+    except Exception as e:
+        record_failure(hit, ctx, e)
+        return None
+    return hit, obj_json, change_set, trace
+
+
+def finish_hit(prepared, ctx):
+    """Save a prepared object and record the outcome in the run journal."""
+    hit, obj_json, change_set, trace = prepared
+    try:
+        with instrumentation.object_trace(hit.uri, trace=trace):
+            save_archival_object(obj_json, change_set, ctx)
+    except Exception as e:
+        record_failure(hit, ctx, e)
+        return
+    if ctx.plan:
+        return
+    ctx.store.record_done(
+        hit.uri,
+        ', '.join(change_set.changed) or 'no changes',
+        change_set.cdx_summaries,
+        aspace_tools.get_ancestor_refs(obj_json)
+    )
+
+
+def sync_hit(hit, ctx):
+    """
+    Fetch and process one search hit, recording the outcome in the run
+    journal. Failures are journalled and reported rather than raised.
+    """
+    prepared = prepare_hit(hit, ctx)
+    if prepared:
+        finish_hit(prepared, ctx)
+
+
+def sync_batch(hits, ctx, pool=None):
+    """
+    Process a batch of hits in stages: compute every change set, create all
+    the DAOs they need with one batch import, then save each object.
+    """
+    run = pool.map if pool else map
+    prepared = [item for item in run(lambda hit: prepare_hit(hit, ctx), hits) if item]
+    if not ctx.plan:
+        create_daos([item[2] for item in prepared], ctx.repo_id, ctx.dao_index)
+    list(run(lambda item: finish_hit(item, ctx), prepared))
+
+
+def create_daos(change_sets, repo_id, dao_index=None):
+    # Any DAO the batch leaves without a dao_ref is created on its own when
+    # its archival object is saved
+    try:
+        with instrumentation.phase('dao_create'):
+            aspace_tools.create_daos_in_batch(change_sets, repo_id, dao_index)
+    except Exception as e:
+        print(f"Batch DAO creation failed: {e}; creating them one at a time.")
+
+
+def resume_hits(hits, ctx):
+    """
+    Order hits for a resumed run: objects that failed last time first, in the
+    order they failed, then those not reached yet. Completed objects are
+    dropped, and their dates are put back into the ancestor roll-up so the
+    final flush still covers them.
+    """
+    statuses = ctx.store.journal_statuses()
+    hits_by_uri = {hit.uri: hit for hit in hits}
+    failures = [(uri, error, attempts) for uri, error, attempts in ctx.store.journal_failures() if uri in hits_by_uri]
+    failed = [hits_by_uri[uri] for uri, _, _ in failures]
+    pending = [hit for hit in hits if hit.uri not in statuses]
+
+    for uri, ancestor_refs, summaries in ctx.store.journal_rollup():
+        # Other shards' objects are rolled up by those shards
+        if uri not in hits_by_uri:
+            continue
+        for summary in summaries.values():
+            summary = at_tools.CdxSummary.from_dict(summary)
+            if summary:
+                ctx.rollup.add_refs(ancestor_refs, summary.begin_date, summary.end_date)
+
+    done = len(hits) - len(failed) - len(pending)
+    print(f"Resuming: {done} archival objects already done, retrying {len(failed)} failed, {len(pending)} not yet reached.")
+    for uri, error, attempts in failures:
+        print(f"  retrying {uri} (attempt {attempts + 1}), last error: {error}")
+    return failed + pending
+
+
+def load_context(refresh_seeds=False, full=False):
+    """One seed load and state store for a run, however many objects it covers."""
+    store = state_store.StateStore()
+    seed_index = at_tools.build_seed_index(at_tools.get_all_seeds(store, refresh=refresh_seeds), store)
+    return SyncContext(Config.aspace_repo, Config.subject, seed_index, store, full=full)
+
+
+def sync_hits(hits, ctx, workers=None, skip_unchanged=True):
+    """
+    Process archival object hits: prefetch their CDX data, drop unchanged
+    ones, write each changed object, then widen shared ancestors once.
+
+    Args:
+        hits: aspace_tools.SearchHit objects with note_urls.
+        ctx: SyncContext for the run.
+        workers: Objects processed concurrently. Defaults to Config.workers.
+        skip_unchanged: Skip objects unchanged since the last sync (unless ctx.full).
+    """
+    # Ancestor ranges a previous run stored but never wrote (it stopped before
+    # or during its flush) are widened by this one
+    ctx.rollup.merge(pending_ancestors_for(ctx))
+
+    # Fetch CDX data for every note URL up front so network latency overlaps
+    pairs = collect_cdx_pairs(hits, ctx.seed_index)
+    print(f"Prefetching CDX data for {len(pairs)} URLs.")
+    ctx.cdx_summaries = at_tools.prefetch_cdx_summaries(pairs, store=ctx.store, refresh=ctx.full, save=not ctx.plan)
+
+    if skip_unchanged and not ctx.full:
+        # Objects last synced before descriptions were recorded are processed
+        # once more (without a write if nothing changed) to record them
+        described = ctx.store.described_uris()
+        changed_hits = []
+        unchanged_uris = []
+        for hit in hits:
+            if hit.uri in described and is_unchanged(hit, ctx):
+                unchanged_uris.append(hit.uri)
+            else:
+                changed_hits.append(hit)
+        if not ctx.plan:
+            ctx.store.record_unchanged(unchanged_uris)
+        ctx.skipped = len(unchanged_uris)
+        hits = changed_hits
+        print(f"Skipping {ctx.skipped} archival objects unchanged since the last sync.")
+
+    # One pass over existing digital objects so DAO creation never duplicates,
+    # unless that costs more requests than checking each object's DAO by id
+    if hits:
+        ctx.dao_index = aspace_tools.build_dao_index(ctx.repo_id, max_pages=len(hits))
+
+    # Workers only write their own archival objects; shared ancestors are
+    # written once, serially, by the roll-up flush below
+    workers = workers or Config.workers
+    aspace_client.size_pool(workers)
+    batch_size = Config.dao_batch_size
+    with (ThreadPoolExecutor(max_workers=workers) if workers > 1 else contextlib.nullcontext()) as pool:
+        if batch_size:
+            for start in range(0, len(hits), batch_size):
+                sync_batch(hits[start:start + batch_size], ctx, pool)
+        elif pool:
+            list(pool.map(lambda hit: sync_hit(hit, ctx), hits))
         else:
-            print("DAO already exists — skipping DAO creation.")
+            for hit in hits:
+                sync_hit(hit, ctx)
 
+    # A shard leaves shared ancestors to the coordinator (see merge_shards)
+    if ctx.plan:
+        ctx.plan.add_ancestors(ctx.rollup)
+    elif not ctx.defer_ancestors:
+        flush_ancestors(ctx.rollup, ctx.store)
+    ctx.processed = len(hits)
+    instrumentation.set_counters('seed matches', ctx.match_rates())
+    print(f"Processed {len(hits)} archival objects, skipped {ctx.skipped} unchanged, {ctx.failed} failed.")
+    if ctx.failed and not ctx.plan:
+        print("Failures are kept in the run journal; rerun with --resume to retry them.")
 
-def update_all_webarchive_aos():
-    repo_id = Config.aspace_repo
-    subject = Config.subject
-    seeds = at_tools.get_all_seeds()
 
-    results = aspace_tools.search_ao_by_subject(repo_id, subject)
-    print(f"Found {len(results)} archival objects for subject '{subject}':\n")
+def parse_shard(value):
+    """argparse type for --shard I/N: shard I (counting from 0) of N."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected I/N, got '{value}'")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be from 0 to {count - 1}")
+    return index, count
 
-    for obj in results:
-        try:
-            obj_json = obj.json()
-            process_archival_object(obj_json, seeds, repo_id, subject)
-        except Exception as e:
-            print(f"Failed to process object {getattr(obj, 'uri', '[No URI]')}: {e}")
 
-def update_single_archival_object(refid):
-    repo_id = Config.aspace_repo
-    seeds = at_tools.get_all_seeds()
+def shard_index(value, count):
+    return int(hashlib.sha1(value.encode()).hexdigest()[:8], 16) % count
+
+
+def shard_of(hit, count, key=None):
+    """
+    Stable shard number for a search hit. Keying by resource (the default,
+    Config.shard_key) keeps a collection's objects and their shared
+    ancestors together; objects without a resource fall back to ref_id.
+    """
+    key = key or Config.shard_key
+    return shard_index((hit.resource_ref if key == 'resource' else None) or hit.ref_id or hit.uri, count)
+
+
+def pending_ancestors_for(ctx):
+    """
+    Stored ancestor ranges for this run to widen. A shard that writes its
+    own ancestors takes only those under its resources, so no two shards
+    write the same record; the rest are left to their own shards.
+    """
+    if ctx.shard and not ctx.defer_ancestors:
+        index, count = ctx.shard
+        resources = [uri for uri in ctx.store.pending_resources() if shard_index(uri, count) == index]
+        return ctx.store.pending_ancestors(resources)
+    return ctx.store.pending_ancestors()
+
+
+def update_all_webarchive_aos(refresh_seeds=False, workers=None, full=False, resume=False, shard=None, defer_ancestors=False, plan=None):
+    """
+    Sync every archival object with the web archives subject.
+
+    Args:
+        resume: Continue the previous run's journal instead of starting over.
+        shard: (index, count) to process only that shard of the objects.
+        defer_ancestors: Collect ancestor date ranges in ctx.rollup without
+                         writing them, for a coordinator to merge and flush.
+        plan: ChangePlan to save the changes to instead of writing them.
+
+    Returns:
+        SyncContext: The run's context, including its ancestor roll-up.
+    """
+    ctx = load_context(refresh_seeds, full)
+    ctx.defer_ancestors = defer_ancestors
+    ctx.shard = shard
+    ctx.plan = plan
+
+    # Keep only lightweight hits; full records are fetched one at a time below
+    hits = []
+    total = 0
+    with instrumentation.phase('search'):
+        for hit in aspace_tools.iter_ao_by_subject(ctx.repo_id, ctx.subject, note_label=Config.phystech_label_scrc):
+            total += 1
+            if hit.note_urls:
+                hits.append(hit)
+    print(f"Found {total} archival objects for subject '{ctx.subject}', {len(hits)} with web archive URLs:\n")
+
+    if shard:
+        index, count = shard
+        hits = [hit for hit in hits if shard_of(hit, count) == index]
+        print(f"Shard {index}/{count}: {len(hits)} archival objects.")
 
+    # Shards share the state store, so each forgets only its own progress
+    if not resume and not plan:
+        ctx.store.clear_journal([hit.uri for hit in hits] if shard else None)
+    if resume:
+        hits = resume_hits(hits, ctx)
+    sync_hits(hits, ctx, workers)
+    return ctx
+
+
+def write_shard_output(path, ctx):
+    """
+    Save a shard's ancestor ranges, totals and raw metrics for merge_shards.
+    Once saved, the ranges are merge_shards' to write, so they are no longer
+    kept pending in the shard's own state store.
+    """
+    with open(path, 'w') as f:
+        json.dump({
+            'processed': ctx.processed,
+            'skipped': ctx.skipped,
+            'failed': ctx.failed,
+            'ancestor_ranges': ctx.rollup.ranges,
+            'instrumentation': instrumentation.dump(),
+        }, f)
+    ctx.store.clear_pending_ancestors(ctx.rollup.ranges)
+
+
+def merge_shards(paths):
+    """
+    Combine shard outputs: widen every ancestor once across all shards, so
+    no two shards write the same record, and merge their run metrics.
+    """
+    rollup = aspace_tools.AncestorRollup()
+    totals = Counter()
+    for path in paths:
+        with open(path) as f:
+            output = json.load(f)
+        rollup.merge(output['ancestor_ranges'])
+        instrumentation.merge(output['instrumentation'])
+        totals.update({key: output[key] for key in ('processed', 'skipped', 'failed')})
+    store = state_store.StateStore()
+    # Kept until written, as in a sync run, in case the merge stops early
+    store.add_pending_ancestors(rollup.ranges)
+    rollup.merge(store.pending_ancestors())
+    flush_ancestors(rollup, store)
+    print(f"Merged {len(paths)} shards: processed {totals['processed']} archival objects, "
+          f"skipped {totals['skipped']} unchanged, {totals['failed']} failed.")
+
+
+def run_shards(count, refresh_seeds=False, workers=None, full=False, resume=False, trace=None):
+    """
+    Coordinate a sharded --all run on this machine: sync the seed cache once,
+    run `count` shard processes side by side, then merge their results.
+    """
+    store = state_store.StateStore()
+    at_tools.get_all_seeds(store, refresh=refresh_seeds)
+    if not resume:
+        store.clear_journal()
+    store.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        processes = []
+        for index in range(count):
+            output = os.path.join(tmp, f"shard-{index}.json")
+            # Shards share the journal the coordinator has just prepared
+            command = [sys.executable, os.path.abspath(__file__), '--all', '--resume',
+                       '--shard', f"{index}/{count}", '--shard-output', output]
+            if workers:
+                command += ['--workers', str(workers)]
+            if full:
+                command.append('--full')
+            if trace:
+                command += ['--trace', trace]
+            processes.append((index, output, subprocess.Popen(command)))
+
+        outputs = []
+        for index, output, process in processes:
+            if process.wait() != 0 or not os.path.exists(output):
+                print(f"Shard {index}/{count} exited with status {process.returncode}; rerun with --resume to retry it.")
+                continue
+            outputs.append(output)
+        merge_shards(outputs)
+
+
+def read_refids(path, column=None):
+    """
+    ref_ids from a file: one per line, or the named column of a CSV file.
+    Blank entries and repeats are dropped.
+    """
+    with open(path, newline='') as f:
+        if column:
+            values = [row.get(column) or '' for row in csv.DictReader(f)]
+        else:
+            values = f.read().splitlines()
+    return list(dict.fromkeys(value.strip() for value in values if value.strip()))
+
+
+def update_archival_objects(refids, refresh_seeds=False, workers=None, full=False, plan=None):
+    """
+    Update the archival objects with the given ref_ids through the same
+    pipeline as a full sync, resolving them in chunked find_by_id requests.
+    Requested objects are always processed, even if unchanged.
+    """
+    refids = list(dict.fromkeys(refids))
+    ctx = load_context(refresh_seeds, full)
+    ctx.plan = plan
+
+    hits = []
+    found = set()
     try:
-        find_url = f"/repositories/{repo_id}/find_by_id/archival_objects?ref_id[]={refid}"
-        response = aspace.client.get(find_url)
-        response.raise_for_status()
-        results = response.json()
-
-        archival_objects = results.get("archival_objects", [])
-        if len(archival_objects) != 1:
-            print(f"{len(archival_objects)} results found for ref_id '{refid}'. Expected exactly 1.")
+        with instrumentation.phase('search'):
+            for hit in aspace_tools.iter_ao_by_ref_ids(ctx.repo_id, refids, note_label=Config.phystech_label_scrc):
+                found.add(hit.ref_id)
+                if hit.note_urls:
+                    print(f"Found archival object: {hit.uri}")
+                    hits.append(hit)
+                else:
+                    print(f"No web archive URLs in {hit.uri} (ref_id '{hit.ref_id}').")
+    except Exception as e:
+        print(f"Error looking up ref_ids: {e}")
+        return
+
+    for refid in refids:
+        if refid not in found:
+            print(f"No archival object found for ref_id '{refid}'.")
+
+    sync_hits(hits, ctx, workers, skip_unchanged=False)
+
+
+def apply_plan(path, workers=None):
+    """
+    Make the writes saved in a --plan file, with no searching or CDX work.
+
+    Each archival object is saved from the record the plan was computed
+    from, so its write carries the planned lock_version. An object edited
+    since planning is rejected by ArchivesSpace, then reloaded and the change
+    set re-applied to the current record (see commit_change_set). New DAOs
+    are created in batches first, and ancestors are widened last, each
+    re-read so a range already covered is not written again.
+    """
+    header, objects, ancestors = read_plan(path)
+    repo_id = header.get('repo_id', Config.aspace_repo)
+    store = state_store.StateStore()
+    items = [(aspace_tools.ChangeSet.from_dict(entry['change_set']), entry['record']) for entry in objects]
+    rollup = aspace_tools.AncestorRollup()
+    for entry in ancestors:
+        rollup.expand(entry['uri'], entry['begin'], entry['end'])
+    # Kept until written, as in a sync run, in case the apply stops early
+    store.add_pending_ancestors(rollup.ranges)
+    rollup.merge(store.pending_ancestors())
+    print(f"Applying {path}: {len(items)} archival objects, {len(ancestors)} ancestors.")
+
+    failed = []
+
+    def apply_one(item):
+        change_set, record = item
+        try:
+            with instrumentation.object_trace(change_set.uri):
+                aspace_tools.commit_change_set(change_set, record, repo_id)
+        except Exception as e:
+            print(f"Failed to apply changes to {change_set.uri}: {e}")
+            failed.append(change_set.uri)
             return
+        record_sync_state(record, change_set, store)
 
-        uri = archival_objects[0]["ref"]
-        print(f"Found archival object: {uri}")
+    workers = workers or Config.workers
+    aspace_client.size_pool(workers)
+    batch_size = Config.dao_batch_size or len(items) or 1
+    with (ThreadPoolExecutor(max_workers=workers) if workers > 1 else contextlib.nullcontext()) as pool:
+        run = pool.map if pool else map
+        for start in range(0, len(items), batch_size):
+            chunk = items[start:start + batch_size]
+            if Config.dao_batch_size:
+                create_daos([change_set for change_set, _ in chunk], repo_id)
+            list(run(apply_one, chunk))
 
-        obj_json = aspace.client.get(uri).json()
-        process_archival_object(obj_json, seeds, repo_id, subject=Config.subject)
+    flush_ancestors(rollup, store)
+    print(f"Applied {len(items) - len(failed)} of {len(items)} archival object changes, {len(failed)} failed.")
 
-    except Exception as e:
-        print(f"Error updating AO with refid '{refid}': {e}")
+
+def update_single_archival_object(refid, refresh_seeds=False):
+    update_archival_objects([refid], refresh_seeds=refresh_seeds)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Sync records that describe web archives in ArchivesSpace using Archive-it intergrations")
     parser.add_argument("--all", action="store_true", help="Update all web archives records.")
-    parser.add_argument("--refid", type=str, help="Update a single archival object by ref_id.")
+    parser.add_argument("--refid", type=str, nargs="+", help="Update archival objects by ref_id.")
+    parser.add_argument("--refid-file", type=str, help="Update the archival objects whose ref_ids are listed in this file, one per line.")
+    parser.add_argument("--refid-column", type=str, help="Read --refid-file as CSV and take ref_ids from this column.")
+    parser.add_argument("--refresh-seeds", action="store_true", help="Re-download the full Archive-It seed list instead of using the local cache.")
+    parser.add_argument("--full", action="store_true", help="Reprocess every archival object and re-read full CDX timemaps, ignoring saved sync state.")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted --all run: skip objects it completed and retry its failures first.")
+    parser.add_argument("--shard", type=parse_shard, help="With --all, process only shard I (from 0) of N, as I/N.")
+    parser.add_argument("--shard-output", type=str, help="With --shard, leave ancestors unwritten and save them and the run metrics to this file for --merge-shards.")
+    parser.add_argument("--shards", type=int, help="With --all, run this many shard processes and merge their results.")
+    parser.add_argument("--merge-shards", type=str, nargs="+", help="Write the ancestors collected in these --shard-output files and merge their metrics.")
+    parser.add_argument("--plan", type=str, help="With --all or --refid, save the changes to this JSONL file instead of writing them.")
+    parser.add_argument("--apply", type=str, help="Make the writes saved in a --plan file.")
+    parser.add_argument("--workers", type=int, help="Number of archival objects to process concurrently.")
+    parser.add_argument("--metrics", type=str, help="Write a JSON summary of phase and HTTP latencies to this file.")
+    parser.add_argument("--trace", type=str, help="Append one JSON line per processed archival object to this file.")
+    parser.add_argument("--seed-memory", action="store_true", help="Measure with tracemalloc the memory saved by holding seeds as compact records, and add it to the run summary.")
+
+    subparsers = parser.add_subparsers(dest="command")
+    report_parser = subparsers.add_parser("report", help="Report on the web archive descriptions recorded by past syncs, without any API requests.")
+    report_parser.add_argument("name", nargs="?", default="summary", choices=sorted(reports.REPORTS),
+                               help="Report to run (default summary). " + " ".join(
+                                   f"{name}: {description}" for name, (description, _) in sorted(reports.REPORTS.items())))
+    report_parser.add_argument("--before", type=str, help="For the stale report: date (YYYY-MM-DD, or e.g. just a year) of the latest capture to count as current.")
+    report_parser.add_argument("--output", type=str, help="Export the report to this CSV or .parquet file instead of printing it.")
+    report_parser.add_argument("--format", choices=["csv", "parquet"], help="Export format, if not given by the --output extension.")
+    report_parser.add_argument("--limit", type=int, default=50, help="Rows to print (default 50).")
 
     args = parser.parse_args()
 
-    if args.all:
-        update_all_webarchive_aos()
-    elif args.refid:
-        update_single_archival_object(args.refid)
+    if args.command == "report":
+        if args.name == "stale" and not args.before:
+            report_parser.error("the stale report needs --before")
+        columns, rows = reports.run_report(state_store.StateStore(), args.name, args.before)
+        if args.output:
+            try:
+                reports.export(args.output, columns, rows, args.format)
+            except RuntimeError as e:
+                report_parser.error(str(e))
+        else:
+            reports.print_table(columns, rows, args.limit)
+        raise SystemExit
+
+    if args.trace:
+        instrumentation.open_trace(args.trace)
+
+    if args.shard and Config.shard_key != 'resource' and not args.shard_output:
+        parser.error("--shard with shard_key other than 'resource' needs --shard-output, so shards do not write shared ancestors")
+    if args.plan and (args.shard or args.shards or args.resume):
+        parser.error("--plan cannot be combined with --shard, --shards or --resume")
+    if args.plan and not (args.all or args.refid or args.refid_file):
+        parser.error("--plan needs --all, --refid or --refid-file")
+
+    plan = ChangePlan(args.plan, Config.aspace_repo) if args.plan else None
+
+    if args.all and args.shards:
+        run_shards(args.shards, refresh_seeds=args.refresh_seeds, workers=args.workers, full=args.full,
+                   resume=args.resume, trace=args.trace)
+    elif args.all:
+        ctx = update_all_webarchive_aos(
+            refresh_seeds=args.refresh_seeds, workers=args.workers, full=args.full, resume=args.resume,
+            shard=args.shard, defer_ancestors=bool(args.shard_output), plan=plan
+        )
+    elif args.merge_shards:
+        merge_shards(args.merge_shards)
+    elif args.refid or args.refid_file:
+        refids = list(args.refid or [])
+        if args.refid_file:
+            refids += read_refids(args.refid_file, args.refid_column)
+        update_archival_objects(refids, refresh_seeds=args.refresh_seeds, workers=args.workers, full=args.full, plan=plan)
+    elif args.apply:
+        apply_plan(args.apply, workers=args.workers)
     else:
         parser.print_help()
+        raise SystemExit
+
+    if plan:
+        plan.close()
+
+    # Added rather than set, so a coordinator's own counts join its shards'
+    instrumentation.add_counters('record cache', aspace_tools.record_cache.stats())
+    instrumentation.add_counters('url canonicalization cache', url_canon.cache_stats())
+    if args.seed_memory:
+        instrumentation.set_counters('seed memory', at_tools.measure_seed_memory(state_store.StateStore()))
+    if args.all and args.shard_output and not args.shards:
+        write_shard_output(args.shard_output, ctx)
+    instrumentation.print_summary()
+    if args.metrics:
+        instrumentation.write_summary(args.metrics)
@@ -0,0 +1,116 @@
+import csv
+import sys
+
+# Aggregate queries over the descriptions table the sync keeps in the state
+# store. Each answers from local data only, with no API requests.
+REPORTS = {
+    'summary': (
+        "Totals across every described archival object.",
+        """
+        SELECT COUNT(DISTINCT uri) AS objects, COUNT(*) AS urls,
+               COUNT(DISTINCT resource) AS resources, COUNT(DISTINCT collection_id) AS collections,
+               SUM(collection_id IS NULL) AS unmatched_urls, SUM(extent) AS captures,
+               SUM(total_bytes) AS total_bytes, MIN(begin_date) AS earliest, MAX(end_date) AS latest,
+               SUM(dao_uri IS NOT NULL) AS urls_with_dao, DATETIME(MAX(synced_at), 'unixepoch') AS last_synced_utc
+        FROM descriptions
+        """
+    ),
+    'resources': (
+        "Objects, URLs, captures and capture range per resource.",
+        """
+        SELECT resource, COUNT(DISTINCT uri) AS objects, COUNT(*) AS urls, SUM(extent) AS captures,
+               SUM(total_bytes) AS total_bytes, MIN(begin_date) AS earliest, MAX(end_date) AS latest
+        FROM descriptions
+        GROUP BY resource
+        ORDER BY captures DESC, resource
+        """
+    ),
+    'collections': (
+        "Objects, URLs, captures and capture range per Archive-It collection.",
+        """
+        SELECT collection_id, COUNT(DISTINCT uri) AS objects, COUNT(*) AS urls, SUM(extent) AS captures,
+               SUM(total_bytes) AS total_bytes, MIN(begin_date) AS earliest, MAX(end_date) AS latest
+        FROM descriptions
+        WHERE collection_id IS NOT NULL
+        GROUP BY collection_id
+        ORDER BY captures DESC, collection_id
+        """
+    ),
+    'stale': (
+        "Archival objects not captured since --before (or never captured).",
+        """
+        SELECT uri, ref_id, title, resource, GROUP_CONCAT(note_url, ' ') AS note_urls,
+               SUM(extent) AS captures, MAX(end_date) AS latest
+        FROM descriptions
+        WHERE collection_id IS NOT NULL
+        GROUP BY uri
+        HAVING MAX(end_date) IS NULL OR MAX(end_date) < :before
+        ORDER BY latest, uri
+        """
+    ),
+    'unmatched': (
+        "Note URLs that could not be matched to an Archive-It collection.",
+        """
+        SELECT uri, ref_id, title, resource, note_url
+        FROM descriptions
+        WHERE collection_id IS NULL
+        ORDER BY resource, uri
+        """
+    ),
+    'descriptions': (
+        "Every recorded row: one per archival object and note URL.",
+        "SELECT * FROM descriptions ORDER BY resource, uri, note_url"
+    ),
+}
+
+
+def run_report(store, name, before=None):
+    """
+    (column names, rows) for one of REPORTS.
+
+    Args:
+        store: state_store.StateStore holding the descriptions.
+        name: Key of REPORTS.
+        before: Date (YYYY-MM-DD or a prefix such as a year) for 'stale'.
+    """
+    _, sql = REPORTS[name]
+    return store.query(sql, {'before': before} if ':before' in sql else ())
+
+
+def write_csv(path, columns, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+
+def write_parquet(path, columns, rows):
+    """Write rows as a Parquet file. Needs the optional pyarrow package."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow); use a .csv file instead.")
+    table = pyarrow.table({column: [row[i] for row in rows] for i, column in enumerate(columns)})
+    pyarrow.parquet.write_table(table, path)
+
+
+def export(path, columns, rows, fmt=None):
+    """Write a report to path as CSV or Parquet, chosen by fmt or the file extension."""
+    fmt = fmt or ('parquet' if path.endswith('.parquet') else 'csv')
+    if fmt == 'parquet':
+        write_parquet(path, columns, rows)
+    else:
+        write_csv(path, columns, rows)
+    print(f"Wrote {len(rows)} rows to {path}.")
+
+
+def print_table(columns, rows, limit=None, out=sys.stdout):
+    """Print rows as aligned columns, at most limit of them."""
+    shown = [['' if value is None else str(value) for value in row] for row in rows[:limit]]
+    widths = [max([len(column)] + [len(row[i]) for row in shown]) for i, column in enumerate(columns)]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)), file=out)
+    for row in shown:
+        print('  '.join(value.ljust(width) for value, width in zip(row, widths)), file=out)
+    if limit is not None and len(rows) > limit:
+        print(f"... {len(rows) - limit} more rows (use --output to export them all)", file=out)
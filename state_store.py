@@ -0,0 +1,401 @@
+import json
+import sqlite3
+import threading
+import time
+from config import Config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS seeds (
+    id INTEGER PRIMARY KEY,
+    url TEXT,
+    canonical_url TEXT,
+    collection INTEGER,
+    created_date TEXT,
+    last_updated_date TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cdx_state (
+    collection_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    earliest TEXT,
+    latest TEXT,
+    count INTEGER NOT NULL DEFAULT 0,
+    total_bytes INTEGER NOT NULL DEFAULT 0,
+    synced_at REAL,
+    PRIMARY KEY (collection_id, url)
+);
+CREATE TABLE IF NOT EXISTS journal (
+    uri TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    outcome TEXT,
+    cdx_summaries TEXT,
+    ancestors TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS descriptions (
+    uri TEXT NOT NULL,
+    note_url TEXT NOT NULL,
+    ref_id TEXT,
+    title TEXT,
+    resource TEXT,
+    collection_id TEXT,
+    begin_date TEXT,
+    end_date TEXT,
+    extent INTEGER,
+    total_bytes INTEGER,
+    dao_uri TEXT,
+    synced_at REAL,
+    PRIMARY KEY (uri, note_url)
+);
+CREATE TABLE IF NOT EXISTS pending_ancestors (
+    uri TEXT PRIMARY KEY,
+    resource TEXT,
+    begin_date TEXT,
+    end_date TEXT
+);
+CREATE TABLE IF NOT EXISTS ao_state (
+    uri TEXT PRIMARY KEY,
+    system_mtime TEXT,
+    lock_version INTEGER,
+    notes_fingerprint TEXT,
+    cdx_summaries TEXT,
+    synced_at REAL
+);
+"""
+
+
+class StateStore:
+    """
+    Local SQLite database holding state that persists between sync runs.
+
+    Args:
+        path: Database file path. Defaults to Config.state_db.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or getattr(Config, 'state_db', 'webarchives_state.sqlite3')
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, str(value))
+            )
+
+    # --- Archive-It seeds -------------------------------------------------
+
+    def seed_count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM seeds").fetchone()[0]
+
+    def load_seeds(self):
+        """Return the cached seeds in created_date order, as partner API dicts."""
+        with self.lock:
+            rows = self.conn.execute("SELECT data FROM seeds ORDER BY created_date, id").fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def iter_seed_rows(self, batch_size=1000):
+        """
+        Yield (id, url, canonical_url, collection, created_date) for each cached
+        seed in created_date order, reading batch_size rows at a time and
+        without decoding the stored partner API JSON.
+        """
+        with self.lock:
+            cursor = self.conn.execute(
+                "SELECT id, url, canonical_url, collection, created_date FROM seeds ORDER BY created_date, id"
+            )
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+
+    def get_seed(self, seed_id):
+        """The full cached partner API dict for one seed, or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM seeds WHERE id = ?", (seed_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_seeds(self, seeds, replace=False):
+        """
+        Upsert seeds into the cache and record the sync time and high-water mark.
+
+        Args:
+            seeds: Seed dicts from the partner API.
+            replace: If True, drop every cached seed first (full refresh).
+        """
+        high_water = self.get_meta('seeds_high_water', '')
+        rows = []
+        for seed in seeds:
+            created = seed.get('created_date') or ''
+            updated = seed.get('last_updated_date') or created
+            high_water = max(high_water, created, updated)
+            rows.append((
+                seed.get('id'),
+                seed.get('url'),
+                seed.get('canonical_url'),
+                seed.get('collection'),
+                created,
+                updated,
+                json.dumps(seed),
+            ))
+
+        with self.lock, self.conn:
+            if replace:
+                self.conn.execute("DELETE FROM seeds")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO seeds "
+                "(id, url, canonical_url, collection, created_date, last_updated_date, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        self.set_meta('seeds_high_water', high_water)
+        self.set_meta('seeds_synced_at', time.time())
+
+    def seeds_age(self):
+        """Seconds since the last seed sync, or None on a cold cache."""
+        synced_at = self.get_meta('seeds_synced_at')
+        return time.time() - float(synced_at) if synced_at else None
+
+    # --- CDX high-water marks ---------------------------------------------
+
+    def get_cdx_summary(self, collection_id, url):
+        """The stored CDX summary dict for a URL, or None if never synced."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT earliest, latest, count, total_bytes FROM cdx_state "
+                "WHERE collection_id = ? AND url = ?",
+                (str(collection_id), url)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('earliest', 'latest', 'count', 'total_bytes'), row))
+
+    def save_cdx_summary(self, collection_id, url, summary):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cdx_state "
+                "(collection_id, url, earliest, latest, count, total_bytes, synced_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(collection_id), url, summary['earliest'], summary['latest'],
+                 summary['count'], summary['total_bytes'], time.time())
+            )
+
+    # --- Archival object sync state ---------------------------------------
+
+    def get_ao_state(self, uri):
+        """What the last sync saw for an archival object, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT system_mtime, lock_version, notes_fingerprint, cdx_summaries FROM ao_state WHERE uri = ?",
+                (uri,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'system_mtime': row[0],
+            'lock_version': row[1],
+            'notes_fingerprint': row[2],
+            'cdx_summaries': json.loads(row[3] or '{}'),
+        }
+
+    def save_ao_state(self, uri, system_mtime, lock_version, notes_fingerprint, cdx_summaries):
+        """
+        Args:
+            uri: Archival object URI.
+            system_mtime: The record's system_mtime, or None if unknown (e.g. just written).
+            lock_version: The record's lock_version after the sync.
+            notes_fingerprint: Fingerprint of the phystech note URLs and the
+                               description config they were written with.
+            cdx_summaries: dict of note URL -> CDX summary dict used for the sync.
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ao_state "
+                "(uri, system_mtime, lock_version, notes_fingerprint, cdx_summaries, synced_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (uri, system_mtime, lock_version, notes_fingerprint,
+                 json.dumps(cdx_summaries, sort_keys=True), time.time())
+            )
+
+    # --- Pending ancestor date ranges --------------------------------------
+
+    def pending_ancestors(self, resources=None):
+        """
+        uri -> [begin, end] for every ancestor range not yet written, or with
+        resources, only for the ancestors under those resources.
+        """
+        with self.lock:
+            if resources is None:
+                rows = self.conn.execute("SELECT uri, begin_date, end_date FROM pending_ancestors").fetchall()
+            else:
+                resources = list(resources)
+                rows = self.conn.execute(
+                    "SELECT uri, begin_date, end_date FROM pending_ancestors "
+                    f"WHERE resource IN ({','.join('?' * len(resources))})",
+                    resources
+                ).fetchall()
+        return {uri: [begin, end] for uri, begin, end in rows}
+
+    def pending_resources(self):
+        """The resources with ancestor ranges not yet written."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT DISTINCT resource FROM pending_ancestors WHERE resource IS NOT NULL"
+            ).fetchall()
+        return [resource for (resource,) in rows]
+
+    def add_pending_ancestors(self, ranges, resource=None):
+        """
+        Record ancestor date ranges that still have to be written, widening
+        any range already pending for the same ancestor.
+
+        Args:
+            ranges: dict of ancestor URI -> (begin, end), as in AncestorRollup.ranges.
+            resource: URI of the resource the ancestors belong to, if known,
+                      so a shard can pick out its own.
+        """
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO pending_ancestors (uri, resource, begin_date, end_date) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(uri) DO UPDATE SET resource = COALESCE(resource, excluded.resource), "
+                "begin_date = COALESCE(MIN(excluded.begin_date, begin_date), excluded.begin_date, begin_date), "
+                "end_date = COALESCE(MAX(excluded.end_date, end_date), excluded.end_date, end_date)",
+                [(uri, resource, begin, end) for uri, (begin, end) in ranges.items()]
+            )
+
+    def clear_pending_ancestors(self, ranges):
+        """
+        Forget pending ranges covered by ranges that have been written. A
+        range widened meanwhile by another process is kept.
+        """
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM pending_ancestors WHERE uri = ? "
+                "AND (begin_date IS NULL OR begin_date >= ?) AND (end_date IS NULL OR end_date <= ?)",
+                [(uri, begin, end) for uri, (begin, end) in ranges.items()]
+            )
+
+    # --- Web archive descriptions -----------------------------------------
+
+    DESCRIPTION_COLUMNS = ('note_url', 'ref_id', 'title', 'resource', 'collection_id',
+                           'begin_date', 'end_date', 'extent', 'total_bytes', 'dao_uri')
+
+    def save_descriptions(self, uri, rows):
+        """
+        Replace what is recorded about an archival object's web archives.
+
+        Args:
+            uri: Archival object URI.
+            rows: One dict per note URL with the keys in DESCRIPTION_COLUMNS.
+        """
+        now = time.time()
+        values = [(uri, *(row.get(column) for column in self.DESCRIPTION_COLUMNS), now) for row in rows]
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM descriptions WHERE uri = ?", (uri,))
+            self.conn.executemany(
+                f"INSERT INTO descriptions (uri, {', '.join(self.DESCRIPTION_COLUMNS)}, synced_at) "
+                f"VALUES ({', '.join('?' * (len(self.DESCRIPTION_COLUMNS) + 2))})",
+                values
+            )
+
+    def described_uris(self):
+        with self.lock:
+            return {uri for (uri,) in self.conn.execute("SELECT DISTINCT uri FROM descriptions")}
+
+    def query(self, sql, params=()):
+        """(column names, rows) for a read-only query, e.g. a report."""
+        with self.lock:
+            cursor = self.conn.execute(sql, params)
+            return [d[0] for d in cursor.description], cursor.fetchall()
+
+    # --- Run journal ------------------------------------------------------
+
+    def clear_journal(self, uris=None):
+        """
+        Start a new run's journal, forgetting the previous run's progress, or
+        with uris, only the progress recorded for those archival objects.
+        """
+        with self.lock, self.conn:
+            if uris is None:
+                self.conn.execute("DELETE FROM journal")
+            else:
+                self.conn.executemany("DELETE FROM journal WHERE uri = ?", [(uri,) for uri in uris])
+
+    def journal_statuses(self):
+        """uri -> 'done' or 'failed' for every archival object the current run has reached."""
+        with self.lock:
+            rows = self.conn.execute("SELECT uri, status FROM journal").fetchall()
+        return dict(rows)
+
+    def journal_failures(self):
+        """(uri, error, attempts) for each archival object that failed in the current run."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT uri, error, attempts FROM journal WHERE status = 'failed' ORDER BY updated_at"
+            ).fetchall()
+
+    def journal_rollup(self):
+        """(uri, ancestor refs, CDX summaries) for each completed object that contributed ancestor dates."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT uri, ancestors, cdx_summaries FROM journal WHERE status = 'done' AND ancestors IS NOT NULL"
+            ).fetchall()
+        return [(uri, json.loads(ancestors), json.loads(summaries or '{}')) for uri, ancestors, summaries in rows]
+
+    def record_done(self, uri, outcome, cdx_summaries=None, ancestors=None):
+        """
+        Args:
+            uri: Archival object URI.
+            outcome: What happened, e.g. the fields written or 'no changes'.
+            cdx_summaries: dict of note URL -> CDX summary dict computed for it.
+            ancestors: Ancestor URIs the object's dates were rolled up into,
+                       so a resumed run can widen them without refetching.
+        """
+        self._journal([(uri, 'done', outcome, cdx_summaries, ancestors, None)])
+
+    def record_unchanged(self, uris):
+        """Mark objects skipped as unchanged since the last sync as done."""
+        self._journal([(uri, 'done', 'unchanged', None, None, None) for uri in uris])
+
+    def record_failure(self, uri, error, cdx_summaries=None):
+        self._journal([(uri, 'failed', None, cdx_summaries, None, error)])
+
+    def _journal(self, entries):
+        now = time.time()
+        rows = [
+            (uri, status, outcome, json.dumps(cdx_summaries or {}, sort_keys=True),
+             json.dumps(ancestors) if ancestors is not None else None, error, now)
+            for uri, status, outcome, cdx_summaries, ancestors, error in entries
+        ]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO journal (uri, status, outcome, cdx_summaries, ancestors, error, attempts, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT(uri) DO UPDATE SET status = excluded.status, outcome = excluded.outcome, "
+                "cdx_summaries = excluded.cdx_summaries, ancestors = excluded.ancestors, "
+                "error = excluded.error, attempts = journal.attempts + 1, updated_at = excluded.updated_at",
+                rows
+            )
@@ -0,0 +1,403 @@
+import json
+import multiprocessing
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+EXAMPLES_PATH = 'ao_examples.json'
+REPO_ID = 2
+SERIES_SIZE = 100
+RESOURCE_SIZE = 1000
+SERIES_ID_OFFSET = 1000000
+COLLECTIONS = 20
+
+
+def load_example_records(path=EXAMPLES_PATH):
+    """ao_examples.json holds several JSON records back to back; return them as a list."""
+    with open(path) as f:
+        text = f.read()
+    decoder = json.JSONDecoder()
+    records = []
+    pos = 0
+    while True:
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        if pos >= len(text):
+            return records
+        record, pos = decoder.raw_decode(text, pos)
+        records.append(record)
+
+
+def note_url(i):
+    return f"https://site{i // 10}.example.org/page/{i}/"
+
+
+def collection_for(i):
+    # Seeds on the same domain share a collection, as they usually do in practice
+    return 10000 + (i // 10) % COLLECTIONS
+
+
+class SyntheticArchive:
+    """
+    Deterministic ArchivesSpace and Archive-It data for `objects` web archive
+    items. Records are generated on request from an ao_examples.json template;
+    only records written by the client are kept in memory.
+
+    Every 20th item has no seed of its own, so its collection has to be
+    inferred from the other seeds on its domain, and every 7th has a seed URL
+    that only matches after canonicalization.
+    """
+
+    def __init__(self, objects, captures, template):
+        self.objects = objects
+        self.captures = captures
+        self.template = json.dumps(template)
+        self.records = {}
+        self.digital_objects = {}
+        self.next_do_id = 1
+        self.lock = threading.Lock()
+
+    # --- ArchivesSpace ----------------------------------------------------
+
+    def item_uri(self, i):
+        return f"/repositories/{REPO_ID}/archival_objects/{i + 1}"
+
+    def item_index(self, uri):
+        m = re.fullmatch(rf"/repositories/{REPO_ID}/archival_objects/(\d+)", uri)
+        if not m:
+            return None
+        i = int(m[1]) - 1
+        return i if 0 <= i < self.objects else None
+
+    def series_uri(self, i):
+        return f"/repositories/{REPO_ID}/archival_objects/{SERIES_ID_OFFSET + i // SERIES_SIZE}"
+
+    def resource_uri(self, i):
+        return f"/repositories/{REPO_ID}/resources/{1 + i // RESOURCE_SIZE}"
+
+    def make_item(self, i):
+        record = json.loads(self.template)
+        url = note_url(i)
+        record.update({
+            'lock_version': 0,
+            'uri': self.item_uri(i),
+            'ref_id': f"bench{i:08d}",
+            'title': url,
+            'display_string': url,
+            'dates': [],
+            'extents': [],
+            'instances': [],
+            'ancestors': [
+                {'ref': self.series_uri(i), 'level': 'series'},
+                {'ref': self.resource_uri(i), 'level': 'collection'},
+            ],
+            'parent': {'ref': self.series_uri(i)},
+            'resource': {'ref': self.resource_uri(i)},
+        })
+        record['notes'] = [note for note in record['notes'] if note.get('type') == 'phystech'][:1]
+        record['notes'][0]['subnotes'][0]['content'] = url
+        return record
+
+    def make_ancestor(self, uri):
+        m = re.fullmatch(rf"/repositories/{REPO_ID}/(archival_objects|resources)/(\d+)", uri)
+        if not m:
+            return None
+        number = int(m[2])
+        if m[1] == 'resources':
+            first = (number - 1) * RESOURCE_SIZE
+            if not 0 <= first < self.objects:
+                return None
+            return {
+                'jsonmodel_type': 'resource', 'uri': uri, 'lock_version': 0,
+                'title': f"Benchmark resource {number}", 'dates': [],
+            }
+        first = (number - SERIES_ID_OFFSET) * SERIES_SIZE
+        if number < SERIES_ID_OFFSET or not 0 <= first < self.objects:
+            return None
+        return {
+            'jsonmodel_type': 'archival_object', 'uri': uri, 'lock_version': 0,
+            'title': f"Benchmark series {number}", 'level': 'series', 'dates': [],
+            'ref_id': f"series{number}", 'resource': {'ref': self.resource_uri(first)},
+            'ancestors': [{'ref': self.resource_uri(first), 'level': 'collection'}],
+        }
+
+    def get_record(self, uri):
+        with self.lock:
+            if uri in self.records:
+                return self.records[uri]
+            if uri in self.digital_objects:
+                return self.digital_objects[uri]
+        i = self.item_index(uri)
+        return self.make_item(i) if i is not None else self.make_ancestor(uri)
+
+    def update_record(self, uri, body):
+        with self.lock:
+            current = self.records.get(uri) or self.digital_objects.get(uri)
+        if current is None:
+            current = self.get_record(uri)
+            if current is None:
+                return 404, {'error': 'Record not found'}
+        with self.lock:
+            if body.get('lock_version') != current.get('lock_version'):
+                return 409, {'error': {'lock_version': ['The record you tried to update has been modified since you fetched it.']}}
+            body['lock_version'] = current.get('lock_version', 0) + 1
+            target = self.digital_objects if uri in self.digital_objects else self.records
+            target[uri] = body
+        return 200, {'status': 'Updated', 'id': int(uri.rsplit('/', 1)[1]), 'lock_version': body['lock_version'], 'uri': uri, 'warnings': []}
+
+    def create_digital_object(self, body):
+        with self.lock:
+            do_id = self.next_do_id
+            self.next_do_id += 1
+            uri = f"/repositories/{REPO_ID}/digital_objects/{do_id}"
+            body.update({'uri': uri, 'lock_version': 0})
+            self.digital_objects[uri] = body
+        return {'status': 'Created', 'id': do_id, 'lock_version': 0, 'uri': uri, 'warnings': []}
+
+    def search(self, page, page_size, fields):
+        first = (page - 1) * page_size
+        results = []
+        for i in range(first, min(first + page_size, self.objects)):
+            record = self.get_record(self.item_uri(i))
+            doc = {'uri': record['uri'], 'json': json.dumps(record), 'primary_type': 'archival_object'}
+            results.append({k: v for k, v in doc.items() if not fields or k in fields})
+        last_page = max(1, -(-self.objects // page_size))
+        return {'first_page': 1, 'last_page': last_page, 'this_page': page, 'total_hits': self.objects, 'results': results}
+
+    def list_digital_objects(self, page, page_size):
+        with self.lock:
+            records = list(self.digital_objects.values())
+        first = (page - 1) * page_size
+        last_page = max(1, -(-len(records) // page_size))
+        return {'first_page': 1, 'last_page': last_page, 'this_page': page, 'total': len(records),
+                'results': records[first:first + page_size]}
+
+    def find_digital_objects(self, identifiers, resolve=False):
+        with self.lock:
+            found = [{'ref': uri, '_resolved': record} if resolve else {'ref': uri}
+                     for uri, record in self.digital_objects.items()
+                     if record.get('digital_object_id') in identifiers]
+        return {'digital_objects': found}
+
+    def batch_import(self, records):
+        # Like ArchivesSpace, a batch with any invalid record creates nothing
+        invalid = [r.get('uri') for r in records if not r.get('digital_object_id') or not r.get('title')]
+        if invalid:
+            return [{'status': [{'type': 'started', 'label': 'Importing records'}]},
+                    {'errors': [f"Invalid record {uri}" for uri in invalid]}]
+        saved = {}
+        for record in records:
+            temp_uri = record.pop('uri')
+            created = self.create_digital_object(record)
+            saved[temp_uri] = [created['uri'], created['id']]
+        return [{'status': [{'type': 'started', 'label': 'Importing records'}]}, {'saved': saved}]
+
+    def find_by_ref_ids(self, ref_ids, resolve=False):
+        found = []
+        for ref_id in ref_ids:
+            m = re.fullmatch(r"bench(\d{8})", ref_id)
+            if m and int(m[1]) < self.objects:
+                uri = self.item_uri(int(m[1]))
+                found.append({'ref': uri, '_resolved': self.get_record(uri)} if resolve else {'ref': uri})
+        return {'archival_objects': found}
+
+    # --- Archive-It -------------------------------------------------------
+
+    def seed_url(self, i):
+        # Every 7th seed was entered with cosmetic differences from its note URL
+        url = note_url(i)
+        return url.replace('https://', 'http://www.').rstrip('/') if i % 7 == 0 else url
+
+    def seeds(self):
+        return [
+            {
+                'id': i + 1,
+                'url': self.seed_url(i),
+                'canonical_url': self.seed_url(i).rstrip('/'),
+                'collection': collection_for(i),
+                'created_date': '2020-01-01T00:00:00Z',
+                'last_updated_date': '2020-01-01T00:00:00Z',
+                'metadata': {'Title': [{'value': f"Seed {i}"}], 'Description': [{'value': f"Synthetic seed {i}"}]},
+            }
+            for i in range(self.objects) if i % 20
+        ]
+
+    def cdx_lines(self, url, since=None, fields=('timestamp', 'length'), collapse=False, limit=None):
+        """
+        One capture a week from 2015 onwards, `captures` in total per URL. The
+        page content changes every fourth capture, which collapse=True folds
+        into one line per change.
+        """
+        start = time.mktime((2015, 1, 1, 0, 0, 0, 0, 0, 0))
+        lines = []
+        previous_digest = None
+        for n in range(self.captures):
+            timestamp = time.strftime("%Y%m%d%H%M%S", time.gmtime(start + n * 7 * 86400 + len(url)))
+            if since and timestamp < since:
+                continue
+            capture = {'timestamp': timestamp, 'length': str(1000 + n), 'digest': f"SHA1{n // 4:08d}"}
+            if collapse and capture['digest'] == previous_digest:
+                continue
+            previous_digest = capture['digest']
+            lines.append(' '.join(capture[field] for field in fields) + '\n')
+        if limit is not None:
+            lines = lines[:limit] if limit >= 0 else lines[limit:]
+        return lines
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    archive = None
+    counters = None
+    counters_lock = threading.Lock()
+    aspace_latency = 0.0
+    cdx_latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def count(self, name):
+        with self.counters_lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_text(self, status, text):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunked(self, status, lines):
+        """Stream lines with chunked transfer encoding, as CDX servers send timemaps."""
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for start in range(0, len(lines), 100):
+            chunk = ''.join(lines[start:start + 100]).encode()
+            self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        path = parsed.path
+        params = parse_qs(parsed.query)
+
+        if path == '/__stats':
+            with self.counters_lock:
+                return self.send_json(200, dict(self.counters))
+
+        if path == '/api/seed':
+            self.count('seed GET')
+            if any(k.endswith('__gte') for k in params):
+                return self.send_json(200, [])
+            return self.send_json(200, self.archive.seeds())
+
+        m = re.fullmatch(r"/(\d+)/timemap/cdx", path)
+        if m:
+            self.count('cdx GET')
+            time.sleep(self.cdx_latency)
+            url = params.get('url', [''])[0]
+            since = params.get('from', [None])[0]
+            fields = params.get('fl', ['timestamp,length'])[0].split(',')
+            collapse = params.get('collapse', [''])[0] == 'digest'
+            limit = int(params['limit'][0]) if 'limit' in params else None
+            return self.send_chunked(200, self.archive.cdx_lines(url, since, fields, collapse, limit))
+
+        self.count('aspace GET')
+        time.sleep(self.aspace_latency)
+
+        if path == '/version':
+            return self.send_text(200, 'ArchivesSpace (v3.5.1)')
+
+        if path == f"/repositories/{REPO_ID}/search":
+            page = int(params.get('page', ['1'])[0])
+            page_size = int(params.get('page_size', ['10'])[0])
+            fields = params.get('fields[]', [])
+            return self.send_json(200, self.archive.search(page, page_size, fields))
+
+        if path == f"/repositories/{REPO_ID}/find_by_id/archival_objects":
+            resolve = 'archival_objects' in params.get('resolve[]', [])
+            return self.send_json(200, self.archive.find_by_ref_ids(params.get('ref_id[]', []), resolve))
+
+        if path == f"/repositories/{REPO_ID}/digital_objects":
+            page = int(params.get('page', ['1'])[0])
+            page_size = int(params.get('page_size', ['10'])[0])
+            return self.send_json(200, self.archive.list_digital_objects(page, page_size))
+
+        if path == f"/repositories/{REPO_ID}/find_by_id/digital_objects":
+            resolve = 'digital_objects' in params.get('resolve[]', [])
+            return self.send_json(200, self.archive.find_digital_objects(params.get('digital_object_id[]', []), resolve))
+
+        record = self.archive.get_record(path)
+        if record is None:
+            return self.send_json(404, {'error': 'Record not found'})
+        return self.send_json(200, record)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self.read_body()
+
+        if re.fullmatch(r"/users/[^/]+/login", path):
+            self.count('aspace login')
+            return self.send_json(200, {'session': 'benchmark-session'})
+
+        self.count('aspace POST')
+        time.sleep(self.aspace_latency)
+
+        if path == f"/repositories/{REPO_ID}/digital_objects":
+            return self.send_json(200, self.archive.create_digital_object(json.loads(body)))
+
+        if path == f"/repositories/{REPO_ID}/batch_imports":
+            return self.send_json(200, self.archive.batch_import(json.loads(body)))
+
+        status, payload = self.archive.update_record(path, json.loads(body))
+        return self.send_json(status, payload)
+
+
+def serve(port, objects, captures, aspace_latency, cdx_latency, ready):
+    template = load_example_records()[0]
+    StubHandler.archive = SyntheticArchive(objects, captures, template)
+    StubHandler.counters = {}
+    StubHandler.aspace_latency = aspace_latency
+    StubHandler.cdx_latency = cdx_latency
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    ready.set()
+    server.serve_forever()
+
+
+def start(port, objects, captures=50, aspace_latency=0.0, cdx_latency=0.0):
+    """
+    Run the ArchivesSpace and Archive-It stand-ins in a child process so
+    their work does not count against the client being measured.
+
+    Returns:
+        multiprocessing.Process: Terminate it to stop the servers.
+    """
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(
+        target=serve,
+        args=(port, objects, captures, aspace_latency, cdx_latency, ready),
+        daemon=True
+    )
+    process.start()
+    ready.wait(30)
+    return process
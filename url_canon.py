@@ -0,0 +1,48 @@
+import re
+from functools import lru_cache
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urlsplit
+
+# Distinct URLs remembered; a run sees each seed and note URL a few times
+CACHE_SIZE = 1 << 17
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+WWW_PREFIX = re.compile(r'^www\d*\.')
+PATH_SAFE = "/:@!$&'()*+,;=~-._"
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def canonicalize(url):
+    """
+    SURT-style match key for a URL, e.g. 'org,example)/page?a=1&b=2'.
+
+    Cosmetic differences are ignored, as the Wayback machine ignores them
+    when looking up captures. Those are the scheme, case, a leading `www.`,
+    default ports, percent-encoding, a trailing slash, the fragment and the
+    order of query parameters.
+    """
+    url = (url or '').strip()
+    if not url:
+        return ''
+    if '://' not in url:
+        url = 'http://' + url
+    try:
+        parts = urlsplit(url.lower())
+        port = parts.port
+    except ValueError:
+        return url.lower()
+
+    host = WWW_PREFIX.sub('', (parts.hostname or '').rstrip('.'))
+    key = ','.join(reversed(host.split('.')))
+    if port and port != DEFAULT_PORTS.get(parts.scheme):
+        key += f":{port}"
+
+    path = quote(unquote(parts.path), safe=PATH_SAFE).rstrip('/') or '/'
+    key += ')' + path
+    if parts.query:
+        key += '?' + urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return key
+
+
+def cache_stats():
+    info = canonicalize.cache_info()
+    return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize}